@@ -5,80 +5,113 @@ ETA calculation endpoints.
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
+from sqlalchemy.orm import joinedload
+import asyncio
 import logging
+from collections import defaultdict
+from typing import Dict, Tuple
 
-from database import get_db
-from models import Bus, BusRoute, Route, Stop, BusLocation
+from config import DB_EXTRA_SESSION_LIMIT
+from database import get_db, session_scope
+from models import Bus, BusRoute, Stop, BusLocation
+from queries import BUS_BY_NUMBER
 from schemas import BusETAResponse
-from utils import haversine_distance, compute_rolling_average_speed, find_next_stop_index
-from cache import get_cached_bus_eta, set_cached_bus_eta
+from utils import (
+    RouteStops,
+    compute_rolling_average_speed,
+    find_next_stop_index,
+    find_stop_index_by_order,
+    build_route_transfer_counts
+)
+from cache import (
+    get_or_compute_bus_eta,
+    get_cached_route_stops,
+    set_cached_route_stops,
+    get_bus_stop_hint,
+    set_bus_stop_hint
+)
 
 router = APIRouter(prefix="/bus", tags=["eta"])
 logger = logging.getLogger(__name__)
 
 
+ETA_TIME_PREFIX = "Estimated arrival time: "
+
+# Requests allowed to hold a second pooled connection at once (see config.py)
+_extra_session_slots = asyncio.Semaphore(DB_EXTRA_SESSION_LIMIT)
+
+# Labels for the common sub-day ETAs, built once at import time.
+_MINUTE_LABELS = tuple(f"{minutes} minute{'s' if minutes != 1 else ''}" for minutes in range(60))
+_HOUR_LABELS = tuple(f"{hours} hour{'s' if hours != 1 else ''}" for hours in range(24))
+
+
 def format_eta_time(eta_minutes: int) -> str:
     """Format ETA minutes into human-readable string."""
     if eta_minutes < 60:
-        time_unit = f"{eta_minutes} minute{'s' if eta_minutes != 1 else ''}"
-    elif eta_minutes < 1440:
-        hours = eta_minutes // 60
-        remaining_minutes = eta_minutes % 60
+        # A negative estimate means the bus is due now
+        return ETA_TIME_PREFIX + _MINUTE_LABELS[eta_minutes if eta_minutes > 0 else 0]
+    
+    if eta_minutes < 1440:
+        hours, remaining_minutes = divmod(eta_minutes, 60)
         if remaining_minutes > 0:
-            time_unit = f"{hours} hour{'s' if hours != 1 else ''} {remaining_minutes} min"
-        else:
-            time_unit = f"{hours} hour{'s' if hours != 1 else ''}"
-    elif eta_minutes < 10080:
+            return f"{ETA_TIME_PREFIX}{_HOUR_LABELS[hours]} {remaining_minutes} min"
+        return ETA_TIME_PREFIX + _HOUR_LABELS[hours]
+    
+    if eta_minutes < 10080:
         days = eta_minutes // 1440
         time_unit = f"{days} day{'s' if days != 1 else ''}"
     else:
         weeks = eta_minutes // 10080
         time_unit = f"{weeks} week{'s' if weeks != 1 else ''}"
     
-    return f"Estimated arrival time: {time_unit}"
+    return ETA_TIME_PREFIX + time_unit
+
+
+# The shared bus lookup, also loading the current route assignment and route
+_BUS_WITH_CURRENT_ROUTE = BUS_BY_NUMBER.options(
+    joinedload(Bus.route_assignments.and_(BusRoute.is_current == True))
+    .joinedload(BusRoute.route)
+)
 
 
 async def get_bus_by_number(db: AsyncSession, bus_number: str) -> Bus:
-    """Retrieve bus by bus number."""
-    bus_result = await db.execute(
-        select(Bus).where(Bus.bus_number == bus_number)
-    )
-    bus = bus_result.scalar_one_or_none()
+    """Retrieve bus by bus number with its current route loaded."""
+    bus_result = await db.execute(_BUS_WITH_CURRENT_ROUTE, {"bus_number": bus_number})
+    bus = bus_result.unique().scalar_one_or_none()
     
     if not bus:
-        logger.warning(f"Bus not found: {bus_number}")
+        logger.warning("Bus not found: %s", bus_number)
         raise HTTPException(status_code=404, detail="Bus not found")
     
     return bus
 
 
-async def get_current_route_assignment(db: AsyncSession, bus_id: int) -> BusRoute:
-    """Get the current route assignment for a bus."""
-    current_route_result = await db.execute(
-        select(BusRoute)
-        .where(BusRoute.bus_id == bus_id, BusRoute.is_current == True)
-    )
-    current_route_assignment = current_route_result.scalar_one_or_none()
-    
-    if not current_route_assignment:
+def get_current_route_assignment(bus: Bus) -> BusRoute:
+    """Get the current route assignment from a bus loaded by get_bus_by_number."""
+    if not bus.route_assignments:
         raise HTTPException(status_code=400, detail="Bus not assigned to any route")
     
-    return current_route_assignment
+    return bus.route_assignments[0]
 
 
-async def get_route_stops(db: AsyncSession, route_id: int) -> list:
-    """Get all stops for a route ordered by stop_order."""
+async def get_route_stops(db: AsyncSession, route_id: int) -> RouteStops:
+    """Get the stops for a route ordered by stop_order, using the route cache."""
+    route_stops = get_cached_route_stops(route_id)
+    if route_stops is not None:
+        return route_stops
+    
     stops_result = await db.execute(
-        select(Stop)
+        select(Stop.stop_id, Stop.stop_name, Stop.stop_order, Stop.latitude, Stop.longitude)
         .where(Stop.route_id == route_id)
         .order_by(Stop.stop_order)
     )
-    stops = list(stops_result.scalars().all())
+    route_stops = RouteStops(stops_result.all())
     
-    if not stops:
+    if not route_stops:
         raise HTTPException(status_code=400, detail="Route has no stops")
     
-    return stops
+    set_cached_route_stops(route_id, route_stops)
+    return route_stops
 
 
 async def get_bus_locations(db: AsyncSession, bus_id: int, limit: int = 10) -> list:
@@ -89,7 +122,7 @@ async def get_bus_locations(db: AsyncSession, bus_id: int, limit: int = 10) -> l
         .order_by(desc(BusLocation.recorded_at))
         .limit(limit)
     )
-    locations = list(locations_result.scalars().all())
+    locations = locations_result.scalars().all()
     
     if not locations:
         raise HTTPException(status_code=400, detail="No location data for bus")
@@ -97,29 +130,87 @@ async def get_bus_locations(db: AsyncSession, bus_id: int, limit: int = 10) -> l
     return locations
 
 
-def calculate_eta_same_route(stops: list, locations: list, target_stop_index: int = None) -> int:
+async def get_route_stops_and_locations(
+    db: AsyncSession,
+    route_id: int,
+    bus_id: int
+) -> tuple:
+    """
+    Load route stops and recent bus locations.
+    
+    On a stop cache miss both are queried at once, the stops on a second
+    connection. When every extra-connection slot is taken, they are
+    queried one after the other on the request session instead, so
+    concurrent misses cannot drain the pool waiting on each other.
+    """
+    route_stops = get_cached_route_stops(route_id)
+    if route_stops is not None:
+        return route_stops, await get_bus_locations(db, bus_id)
+    
+    if _extra_session_slots.locked():
+        route_stops = await get_route_stops(db, route_id)
+        return route_stops, await get_bus_locations(db, bus_id)
+    
+    async def load_route_stops() -> RouteStops:
+        async with session_scope() as stops_db:
+            return await get_route_stops(stops_db, route_id)
+    
+    # Taking a free slot never suspends, so the check above still holds.
+    # Let both queries finish before raising, so neither outlives the request session.
+    async with _extra_session_slots:
+        results = await asyncio.gather(
+            load_route_stops(),
+            get_bus_locations(db, bus_id),
+            return_exceptions=True
+        )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    
+    return results[0], results[1]
+
+
+def locate_next_stop(route_id: int, route_stops: RouteStops, location: BusLocation) -> int:
+    """Find the nearest stop for a bus, starting from its last known stop."""
+    hint = get_bus_stop_hint(location.bus_id, route_id)
+    next_stop_index = find_next_stop_index(
+        route_stops,
+        location.latitude,
+        location.longitude,
+        hint
+    )
+    set_bus_stop_hint(location.bus_id, route_id, next_stop_index)
+    return next_stop_index
+
+
+def calculate_eta_same_route(
+    route_stops: RouteStops,
+    locations: list,
+    target_stop_index: int = None,
+    next_stop_index: int = None
+) -> int:
     """Calculate ETA when bus is on the same route as user."""
     avg_speed_kmh = compute_rolling_average_speed(locations)
     current_location = locations[0]
+    stop_count = len(route_stops)
     
-    next_stop_index = find_next_stop_index(
-        stops,
-        current_location.latitude,
-        current_location.longitude
-    )
+    if next_stop_index is None:
+        next_stop_index = find_next_stop_index(
+            route_stops,
+            current_location.latitude,
+            current_location.longitude
+        )
     
-    if target_stop_index is not None and target_stop_index < len(stops):
-        target_stop = stops[target_stop_index]
-    elif next_stop_index + 1 < len(stops):
-        target_stop = stops[next_stop_index + 1]
-    else:
-        target_stop = stops[next_stop_index] if next_stop_index < len(stops) else stops[0]
+    if target_stop_index is None or target_stop_index >= stop_count:
+        if next_stop_index + 1 < stop_count:
+            target_stop_index = next_stop_index + 1
+        else:
+            target_stop_index = next_stop_index if next_stop_index < stop_count else 0
     
-    distance_to_next_stop_km = haversine_distance(
+    distance_to_next_stop_km = route_stops.distance_km_to(
+        target_stop_index,
         current_location.latitude,
-        current_location.longitude,
-        target_stop.latitude,
-        target_stop.longitude
+        current_location.longitude
     )
     
     if avg_speed_kmh > 0:
@@ -137,6 +228,48 @@ def calculate_eta_different_route(route_difference: int) -> int:
     return (route_difference * base_time_per_route) + additional_time
 
 
+# (current_route_id, requested_route_id) -> (route changes, transfer minutes)
+# for routes linked by shared stops. Built at startup by load_route_transfer_table.
+route_transfers: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+
+async def load_route_transfer_table(db: AsyncSession) -> int:
+    """Precompute transfer minutes between all routes connected by shared stops."""
+    stops_result = await db.execute(select(Stop.route_id, Stop.stop_name))
+    
+    stop_names_by_route = defaultdict(list)
+    for route_id, stop_name in stops_result:
+        stop_names_by_route[route_id].append(stop_name)
+    
+    transfer_counts = build_route_transfer_counts(stop_names_by_route)
+    
+    route_transfers.clear()
+    route_transfers.update(
+        (route_pair, (transfers, calculate_eta_different_route(transfers)))
+        for route_pair, transfers in transfer_counts.items()
+    )
+    return len(route_transfers)
+
+
+def get_route_transfer(current_route_id: int, route_id: int) -> Tuple[int, int]:
+    """
+    Look up the route changes and transfer ETA between two routes.
+    
+    Routes not linked by shared stops fall back to the route-id heuristic,
+    with the id difference standing in for the number of route changes.
+    """
+    transfer = route_transfers.get((current_route_id, route_id))
+    if transfer is None:
+        route_difference = abs(route_id - current_route_id)
+        transfer = (route_difference, calculate_eta_different_route(route_difference))
+    return transfer
+
+
+def get_transfer_minutes(current_route_id: int, route_id: int) -> int:
+    """Look up the transfer ETA between two routes, falling back to the route-id heuristic."""
+    return get_route_transfer(current_route_id, route_id)[1]
+
+
 @router.get("/{bus_number}/eta", response_model=BusETAResponse)
 async def get_bus_eta(
     bus_number: str,
@@ -144,42 +277,33 @@ async def get_bus_eta(
     db: AsyncSession = Depends(get_db)
 ):
     """Calculate the estimated time of arrival for a bus."""
-    logger.info(f"Calculating ETA for bus {bus_number} to route {route_id}")
+    logger.info("Calculating ETA for bus %s to route %s", bus_number, route_id)
     
-    # Check cache first
-    cached = get_cached_bus_eta(bus_number, route_id)
-    if cached:
-        logger.debug(f"Returning cached ETA for {bus_number}")
-        return BusETAResponse(**cached)
-    
-    bus = await get_bus_by_number(db, bus_number)
-    current_route_assignment = await get_current_route_assignment(db, bus.bus_id)
-    current_route_id = current_route_assignment.route_id
-    
-    route_difference = abs(route_id - current_route_id)
-    
-    if route_difference == 0:
-        route = await db.get(Route, current_route_id)
-        if not route:
-            raise HTTPException(status_code=404, detail="Route not found")
+    async def compute_eta() -> dict:
+        bus = await get_bus_by_number(db, bus_number)
+        current_route_assignment = get_current_route_assignment(bus)
+        current_route_id = current_route_assignment.route_id
         
-        stops = await get_route_stops(db, route.route_id)
-        locations = await get_bus_locations(db, bus.bus_id)
+        if route_id == current_route_id:
+            route = current_route_assignment.route
+            if not route:
+                raise HTTPException(status_code=404, detail="Route not found")
+            
+            route_stops, locations = await get_route_stops_and_locations(db, route.route_id, bus.bus_id)
+            next_stop_index = locate_next_stop(route.route_id, route_stops, locations[0])
+            
+            eta_minutes = calculate_eta_same_route(route_stops, locations, next_stop_index=next_stop_index)
+        else:
+            eta_minutes = get_transfer_minutes(current_route_id, route_id)
         
-        eta_minutes = calculate_eta_same_route(stops, locations)
-    else:
-        eta_minutes = calculate_eta_different_route(route_difference)
-    
-    estimated_arrival_time = format_eta_time(eta_minutes)
-    
-    result = {
-        "bus_number": bus.bus_number,
-        "estimated_arrival_time": estimated_arrival_time,
-        "current_route_id": current_route_id
-    }
+        return {
+            "bus_number": bus.bus_number,
+            "estimated_arrival_time": format_eta_time(eta_minutes),
+            "current_route_id": current_route_id
+        }
     
-    # Cache the result
-    set_cached_bus_eta(bus_number, route_id, result)
+    # Concurrent cache misses for the same bus and route share one computation
+    result = await get_or_compute_bus_eta(bus_number, route_id, compute_eta)
     
     return BusETAResponse(**result)
 
@@ -193,10 +317,10 @@ async def get_detailed_bus_eta(
 ):
     """Get detailed ETA information including distance and speed."""
     bus = await get_bus_by_number(db, bus_number)
-    current_route_assignment = await get_current_route_assignment(db, bus.bus_id)
+    current_route_assignment = get_current_route_assignment(bus)
     current_route_id = current_route_assignment.route_id
     
-    route_difference = abs(route_id - current_route_id)
+    route_difference, transfer_minutes = get_route_transfer(current_route_id, route_id)
     
     response_data = {
         "bus_number": bus.bus_number,
@@ -208,52 +332,44 @@ async def get_detailed_bus_eta(
     }
     
     if route_difference == 0:
-        route = await db.get(Route, current_route_id)
-        stops = await get_route_stops(db, route.route_id)
-        locations = await get_bus_locations(db, bus.bus_id)
+        route = current_route_assignment.route
+        route_stops, locations = await get_route_stops_and_locations(db, route.route_id, bus.bus_id)
         
         current_location = locations[0]
         avg_speed_kmh = compute_rolling_average_speed(locations)
+        next_stop_index = locate_next_stop(route.route_id, route_stops, current_location)
         
         target_stop_index = None
         if stop_order is not None:
-            for i, stop in enumerate(stops):
-                if stop.stop_order == stop_order:
-                    target_stop_index = i
-                    break
+            target_stop_index = find_stop_index_by_order(route_stops, stop_order)
         
         if target_stop_index is None:
-            next_stop_index = find_next_stop_index(stops, current_location.latitude, current_location.longitude)
-            target_stop_index = min(next_stop_index + 1, len(stops) - 1)
-        
-        target_stop = stops[target_stop_index]
+            target_stop_index = min(next_stop_index + 1, len(route_stops) - 1)
         
-        distance_km = haversine_distance(
+        distance_km = route_stops.distance_km_to(
+            target_stop_index,
             current_location.latitude,
-            current_location.longitude,
-            target_stop.latitude,
-            target_stop.longitude
+            current_location.longitude
         )
         
-        eta_minutes = calculate_eta_same_route(stops, locations, target_stop_index)
+        eta_minutes = calculate_eta_same_route(route_stops, locations, target_stop_index, next_stop_index)
         
         response_data.update({
             "route_name": route.route_name,
             "current_latitude": current_location.latitude,
             "current_longitude": current_location.longitude,
-            "target_stop_name": target_stop.stop_name,
-            "target_stop_order": target_stop.stop_order,
+            "target_stop_name": route_stops.names[target_stop_index],
+            "target_stop_order": route_stops.orders[target_stop_index],
             "distance_km": round(distance_km, 2),
             "average_speed_kmh": round(avg_speed_kmh, 1),
             "eta_minutes": eta_minutes,
             "estimated_arrival_time": format_eta_time(eta_minutes),
-            "total_stops_on_route": len(stops)
+            "total_stops_on_route": len(route_stops)
         })
     else:
-        eta_minutes = calculate_eta_different_route(route_difference)
         response_data.update({
-            "eta_minutes": eta_minutes,
-            "estimated_arrival_time": format_eta_time(eta_minutes),
+            "eta_minutes": transfer_minutes,
+            "estimated_arrival_time": format_eta_time(transfer_minutes),
             "note": "Bus is on a different route"
         })
     
@@ -4,16 +4,26 @@ Bus location endpoints for real-time tracking.
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, and_, func
+import heapq
 import logging
 
 from database import get_db
 from models import Bus, BusLocation, BusRoute, Route
 from schemas import BusLocationResponse
+from utils import haversine_distances
 
 router = APIRouter(prefix="/bus", tags=["locations"])
 logger = logging.getLogger(__name__)
 
+# ISO 8601 in UTC, matching datetime.isoformat() for timestamptz values.
+ISO_TIMESTAMP_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'
+
+
+def iso_timestamp(column):
+    """Format a timestamp column as an ISO 8601 string in the query itself."""
+    return func.to_char(func.timezone("UTC", column), ISO_TIMESTAMP_FORMAT)
+
 
 @router.get("/{bus_id}/live", response_model=BusLocationResponse)
 async def get_live_bus_location(
@@ -21,21 +31,13 @@ async def get_live_bus_location(
     db: AsyncSession = Depends(get_db)
 ):
     """Get the live location of a specific bus."""
-    logger.info(f"Fetching live location for bus_id: {bus_id}")
+    logger.info("Fetching live location for bus_id: %s", bus_id)
     
     bus = await db.get(Bus, bus_id)
     if not bus:
-        logger.warning(f"Bus not found: {bus_id}")
+        logger.warning("Bus not found: %s", bus_id)
         raise HTTPException(status_code=404, detail="Bus not found")
 
-    result = await db.execute(
-        select(BusLocation)
-        .where(BusLocation.bus_id == bus_id)
-        .order_by(desc(BusLocation.recorded_at))
-        .limit(1)
-    )
-    location = result.scalar_one_or_none()
-
     route_name = None
     current_route_result = await db.execute(
         select(BusRoute)
@@ -52,9 +54,9 @@ async def get_live_bus_location(
         bus_id=bus.bus_id,
         bus_number=bus.bus_number,
         is_active=bus.is_active,
-        latest_latitude=location.latitude if location else None,
-        latest_longitude=location.longitude if location else None,
-        recorded_at=location.recorded_at.isoformat() if location else None,
+        latest_latitude=bus.last_latitude,
+        latest_longitude=bus.last_longitude,
+        recorded_at=bus.last_recorded_at.isoformat() if bus.last_recorded_at else None,
         route_name=route_name
     )
 
@@ -71,63 +73,96 @@ async def get_bus_location_history(
         raise HTTPException(status_code=404, detail="Bus not found")
 
     result = await db.execute(
-        select(BusLocation)
+        select(
+            BusLocation.latitude,
+            BusLocation.longitude,
+            iso_timestamp(BusLocation.recorded_at).label("recorded_at")
+        )
         .where(BusLocation.bus_id == bus_id)
         .order_by(desc(BusLocation.recorded_at))
         .limit(limit)
     )
-    locations = result.scalars().all()
+    locations = [dict(row) for row in result.mappings()]
 
     return {
         "bus_id": bus.bus_id,
         "bus_number": bus.bus_number,
         "total_records": len(locations),
-        "locations": [
-            {
-                "latitude": loc.latitude,
-                "longitude": loc.longitude,
-                "recorded_at": loc.recorded_at.isoformat()
-            }
-            for loc in locations
-        ]
+        "locations": locations
     }
 
 
+def select_active_buses_with_latest_location():
+    """Build a query for active buses with their latest location and current route."""
+    return (
+        select(
+            Bus.bus_id,
+            Bus.bus_number,
+            Bus.last_latitude.label("latitude"),
+            Bus.last_longitude.label("longitude"),
+            iso_timestamp(Bus.last_recorded_at).label("recorded_at"),
+            Route.route_name
+        )
+        .outerjoin(BusRoute, and_(BusRoute.bus_id == Bus.bus_id, BusRoute.is_current == True))
+        .outerjoin(Route, Route.route_id == BusRoute.route_id)
+        .where(Bus.is_active == True)
+        .order_by(Bus.bus_id)
+    )
+
+
 @router.get("/active")
 async def get_all_active_buses(db: AsyncSession = Depends(get_db)):
     """Get all active buses with their current locations."""
-    result = await db.execute(select(Bus).where(Bus.is_active == True))
-    buses = result.scalars().all()
+    result = await db.execute(select_active_buses_with_latest_location())
     
-    active_buses = []
-    for bus in buses:
-        loc_result = await db.execute(
-            select(BusLocation)
-            .where(BusLocation.bus_id == bus.bus_id)
-            .order_by(desc(BusLocation.recorded_at))
-            .limit(1)
-        )
-        location = loc_result.scalar_one_or_none()
-        
-        route_result = await db.execute(
-            select(BusRoute)
-            .where(BusRoute.bus_id == bus.bus_id, BusRoute.is_current == True)
-        )
-        route_assignment = route_result.scalar_one_or_none()
-        
-        route_name = None
-        if route_assignment:
-            route = await db.get(Route, route_assignment.route_id)
-            if route:
-                route_name = route.route_name
-        
-        active_buses.append({
-            "bus_id": bus.bus_id,
-            "bus_number": bus.bus_number,
-            "latitude": location.latitude if location else None,
-            "longitude": location.longitude if location else None,
-            "last_update": location.recorded_at.isoformat() if location else None,
-            "route_name": route_name
-        })
+    active_buses = [
+        {
+            "bus_id": row.bus_id,
+            "bus_number": row.bus_number,
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+            "last_update": row.recorded_at,
+            "route_name": row.route_name
+        }
+        for row in result
+    ]
     
     return {"total_active": len(active_buses), "buses": active_buses}
+
+
+@router.get("/nearest")
+async def get_nearest_buses(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    limit: int = Query(default=5, ge=1, le=50),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the active buses closest to a position."""
+    result = await db.execute(select_active_buses_with_latest_location())
+    rows = [row for row in result if row.latitude is not None]
+    
+    distances = haversine_distances(
+        latitude,
+        longitude,
+        [row.latitude for row in rows],
+        [row.longitude for row in rows]
+    )
+    nearest = heapq.nsmallest(limit, zip(distances, rows), key=lambda pair: pair[0])
+    
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "total_results": len(nearest),
+        "buses": [
+            {
+                "bus_id": row.bus_id,
+                "bus_number": row.bus_number,
+                "latitude": row.latitude,
+                "longitude": row.longitude,
+                "last_update": row.recorded_at,
+                "route_name": row.route_name,
+                "distance_km": round(distance_km, 2)
+            }
+            for distance_km, row in nearest
+        ]
+    }
@@ -2,13 +2,17 @@
 Bus route endpoints for route information and assignments.
 """
 
+from collections import defaultdict
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
 import logging
+import orjson
 
 from database import get_db
-from models import Bus, BusRoute, Route, Stop
+from models import BusRoute, Route, Stop
+from queries import BUS_BY_NUMBER
 from schemas import BusRouteInfoResponse
 
 router = APIRouter(prefix="/bus", tags=["routes"])
@@ -21,15 +25,13 @@ async def get_bus_routes(
     db: AsyncSession = Depends(get_db)
 ):
     """Get current and previous route assignments for a bus."""
-    logger.info(f"Fetching routes for bus: {bus_number}")
+    logger.info("Fetching routes for bus: %s", bus_number)
     
-    result = await db.execute(
-        select(Bus).where(Bus.bus_number == bus_number)
-    )
+    result = await db.execute(BUS_BY_NUMBER, {"bus_number": bus_number})
     bus = result.scalar_one_or_none()
     
     if not bus:
-        logger.warning(f"Bus not found: {bus_number}")
+        logger.warning("Bus not found: %s", bus_number)
         raise HTTPException(status_code=404, detail="Bus not found")
     
     current_route_result = await db.execute(
@@ -58,7 +60,7 @@ async def get_bus_routes(
             .order_by(desc(BusRoute.assigned_at))
             .limit(2)
         )
-        routes = list(route_result.scalars().all())
+        routes = route_result.scalars().all()
         if routes:
             current_route = routes[0]
             if len(routes) > 1:
@@ -77,9 +79,7 @@ async def get_detailed_bus_routes(
     db: AsyncSession = Depends(get_db)
 ):
     """Get detailed route information including stops for a bus."""
-    result = await db.execute(
-        select(Bus).where(Bus.bus_number == bus_number)
-    )
+    result = await db.execute(BUS_BY_NUMBER, {"bus_number": bus_number})
     bus = result.scalar_one_or_none()
     
     if not bus:
@@ -103,27 +103,17 @@ async def get_detailed_bus_routes(
         route = await db.get(Route, current_route_assignment.route_id)
         
         stops_result = await db.execute(
-            select(Stop)
+            select(Stop.stop_id, Stop.stop_name, Stop.stop_order, Stop.latitude, Stop.longitude)
             .where(Stop.route_id == route.route_id)
             .order_by(Stop.stop_order)
         )
-        stops = stops_result.scalars().all()
         
         response_data["current_route"] = {
             "route_id": route.route_id,
             "route_name": route.route_name,
             "route_number": route.route_number,
-            "assigned_at": current_route_assignment.assigned_at.isoformat(),
-            "stops": [
-                {
-                    "stop_id": stop.stop_id,
-                    "stop_name": stop.stop_name,
-                    "stop_order": stop.stop_order,
-                    "latitude": stop.latitude,
-                    "longitude": stop.longitude
-                }
-                for stop in stops
-            ]
+            "assigned_at": current_route_assignment.assigned_at,
+            "stops": [dict(stop) for stop in stops_result.mappings()]
         }
     
     history_result = await db.execute(
@@ -134,13 +124,21 @@ async def get_detailed_bus_routes(
     )
     history = history_result.scalars().all()
     
+    history_route_ids = [assignment.route_id for assignment in history]
+    routes_by_id = {}
+    if history_route_ids:
+        history_routes_result = await db.execute(
+            select(Route).where(Route.route_id.in_(history_route_ids))
+        )
+        routes_by_id = {route.route_id: route for route in history_routes_result.scalars().all()}
+    
     for assignment in history:
-        route = await db.get(Route, assignment.route_id)
+        route = routes_by_id.get(assignment.route_id)
         if route:
             response_data["route_history"].append({
                 "route_id": route.route_id,
                 "route_name": route.route_name,
-                "assigned_at": assignment.assigned_at.isoformat()
+                "assigned_at": assignment.assigned_at
             })
     
     return response_data
@@ -149,24 +147,35 @@ async def get_detailed_bus_routes(
 @router.get("/routes/all")
 async def get_all_routes(db: AsyncSession = Depends(get_db)):
     """Get all available routes with their stops."""
-    result = await db.execute(select(Route).order_by(Route.route_id))
-    routes = result.scalars().all()
+    result = await db.execute(
+        select(Route.route_id, Route.route_name, Route.route_number)
+        .order_by(Route.route_id)
+    )
+    routes = result.mappings().all()
     
-    routes_data = []
-    for route in routes:
+    stops_by_route = defaultdict(list)
+    route_ids = [route["route_id"] for route in routes]
+    if route_ids:
         stops_result = await db.execute(
-            select(Stop)
-            .where(Stop.route_id == route.route_id)
-            .order_by(Stop.stop_order)
+            select(Stop.route_id, Stop.stop_name, Stop.stop_order)
+            .where(Stop.route_id.in_(route_ids))
+            .order_by(Stop.route_id, Stop.stop_order)
         )
-        stops = stops_result.scalars().all()
-        
-        routes_data.append({
-            "route_id": route.route_id,
-            "route_name": route.route_name,
-            "route_number": route.route_number,
-            "total_stops": len(stops),
-            "stops": [{"stop_name": stop.stop_name, "stop_order": stop.stop_order} for stop in stops]
-        })
+        for route_id, stop_name, stop_order in stops_result:
+            stops_by_route[route_id].append({"stop_name": stop_name, "stop_order": stop_order})
+    
+    async def encode_routes():
+        # One chunk per route, so the full response body is never built in memory
+        yield b'{"total_routes":%d,"routes":[' % len(routes)
+        separator = b""
+        for route in routes:
+            stops = stops_by_route.pop(route["route_id"], [])
+            yield separator + orjson.dumps({
+                **route,
+                "total_stops": len(stops),
+                "stops": stops
+            })
+            separator = b","
+        yield b"]}"
     
-    return {"total_routes": len(routes_data), "routes": routes_data}
+    return StreamingResponse(encode_routes(), media_type="application/json")
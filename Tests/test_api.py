@@ -4,7 +4,12 @@ Unit tests for the Public Transport Tracking API.
 
 import pytest
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import select, text
+
+from database import SessionLocal, engine, get_db
 from main import app
+from models import Route, Stop
+from utils import haversine_distance
 
 
 @pytest.fixture
@@ -12,6 +17,14 @@ def anyio_backend():
     return 'asyncio'
 
 
+@pytest.fixture(autouse=True)
+async def release_pool(anyio_backend):
+    # Each test runs on a fresh event loop and pooled asyncpg connections
+    # are bound to the loop that opened them, so none may outlive a test.
+    yield
+    await engine.dispose()
+
+
 @pytest.mark.anyio
 async def test_health_check():
     """Test the health check endpoint."""
@@ -48,3 +61,101 @@ async def test_bus_not_found():
     ) as client:
         response = await client.get("/bus/99999/live")
         assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_nearest_buses_invalid_coordinates():
+    """Test nearest bus lookup rejects out-of-range coordinates."""
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://test"
+    ) as client:
+        response = await client.get("/bus/nearest?latitude=100&longitude=0")
+        assert response.status_code == 422
+
+
+async def expected_all_routes():
+    """Build the /bus/routes/all body the way the endpoint did before it streamed."""
+    async with SessionLocal() as db:
+        routes = (await db.execute(select(Route).order_by(Route.route_id))).scalars().all()
+        routes_data = []
+        for route in routes:
+            stops = (await db.execute(
+                select(Stop).where(Stop.route_id == route.route_id).order_by(Stop.stop_order)
+            )).scalars().all()
+            routes_data.append({
+                "route_id": route.route_id,
+                "route_name": route.route_name,
+                "route_number": route.route_number,
+                "total_stops": len(stops),
+                "stops": [{"stop_name": stop.stop_name, "stop_order": stop.stop_order} for stop in stops]
+            })
+    return {"total_routes": len(routes_data), "routes": routes_data}
+
+
+@pytest.mark.anyio
+async def test_all_routes_stream_matches_previous_shape():
+    """Test that the streamed route list parses to the same body as before."""
+    expected = await expected_all_routes()
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://test"
+    ) as client:
+        response = await client.get("/bus/routes/all")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == expected
+
+
+@pytest.mark.anyio
+async def test_all_routes_stream_with_no_routes():
+    """Test that an empty route table still streams valid JSON."""
+    async def get_db_without_routes():
+        # Deleted inside a transaction that is always rolled back
+        async with SessionLocal() as db:
+            await db.execute(text("DELETE FROM transport.routes"))
+            try:
+                yield db
+            finally:
+                await db.rollback()
+
+    app.dependency_overrides[get_db] = get_db_without_routes
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app=app),
+            base_url="http://test"
+        ) as client:
+            response = await client.get("/bus/routes/all")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == {"total_routes": 0, "routes": []}
+
+
+@pytest.mark.anyio
+async def test_nearest_buses_ranked_by_distance():
+    """Test that nearest buses come back closest first with their distances."""
+    latitude, longitude = 40.7580, -73.9855
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://test"
+    ) as client:
+        response = await client.get(f"/bus/nearest?latitude={latitude}&longitude={longitude}&limit=50")
+        assert response.status_code == 200
+        buses = response.json()["buses"]
+
+        response = await client.get(f"/bus/nearest?latitude={latitude}&longitude={longitude}&limit=2")
+        assert response.status_code == 200
+        nearest_two = response.json()["buses"]
+
+    assert buses
+    distances = [bus["distance_km"] for bus in buses]
+    assert distances == sorted(distances)
+    for bus in buses:
+        assert bus["distance_km"] == pytest.approx(
+            haversine_distance(latitude, longitude, bus["latitude"], bus["longitude"]), abs=0.005
+        )
+    assert [bus["distance_km"] for bus in nearest_two] == distances[:2]
@@ -0,0 +1,124 @@
+"""
+Unit tests for the in-memory cache.
+"""
+
+import asyncio
+
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear_all_cache()
+    yield
+    cache.clear_all_cache()
+
+
+def test_bus_eta_round_trip():
+    """Test storing and retrieving a bus ETA entry."""
+    data = {"bus_number": "BUS-001", "estimated_arrival_time": "Estimated arrival time: 5 minutes", "current_route_id": 1}
+
+    assert cache.get_cached_bus_eta("BUS-001", 1) is None
+    cache.set_cached_bus_eta("BUS-001", 1, data)
+    assert cache.get_cached_bus_eta("BUS-001", 1) == data
+
+
+def test_expired_entries_are_removed(monkeypatch):
+    """Test that entries past their TTL are not returned and are cleaned up."""
+    cache.set_cached_bus_eta("BUS-001", 1, {"bus_number": "BUS-001"})
+    cache.set_cached_bus_eta("BUS-002", 1, {"bus_number": "BUS-002"})
+
+    expired = cache.time.monotonic() + cache.CACHE_TTL_SECONDS + 1
+    monkeypatch.setattr(cache.time, "monotonic", lambda: expired)
+
+    assert cache.get_cached_bus_eta("BUS-001", 1) is None
+    assert cache.cleanup_expired_cache() == 1
+
+
+def test_entry_replaced_after_scan_is_kept(monkeypatch):
+    """Test that an entry re-set between the scan and the removal survives."""
+    cache.set_cached_bus_eta("BUS-001", 1, {"bus_number": "BUS-001"})
+
+    now = cache.time.monotonic()
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now + cache.CACHE_TTL_SECONDS + 1)
+    expired = cache.collect_expired_entries()
+    assert len(expired) == 1
+
+    cache.set_cached_bus_eta("BUS-001", 1, {"bus_number": "BUS-001", "fresh": True})
+
+    assert cache.remove_expired_entries(expired) == 0
+    assert cache.get_cached_bus_eta("BUS-001", 1) == {"bus_number": "BUS-001", "fresh": True}
+
+
+def test_invalidate_bus():
+    """Test that invalidating a bus drops all of its ETA entries."""
+    cache.set_cached_bus_eta("BUS-001", 1, {"bus_number": "BUS-001"})
+    cache.set_cached_bus_eta("BUS-001", 2, {"bus_number": "BUS-001"})
+    cache.set_cached_bus_eta("BUS-002", 1, {"bus_number": "BUS-002"})
+
+    cache.invalidate_bus("BUS-001")
+
+    assert cache.get_cached_bus_eta("BUS-001", 1) is None
+    assert cache.get_cached_bus_eta("BUS-001", 2) is None
+    assert cache.get_cached_bus_eta("BUS-002", 1) is not None
+
+
+@pytest.mark.anyio
+async def test_get_or_compute_bus_eta_computes_once():
+    """Test that concurrent misses for the same key share one computation."""
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"bus_number": "BUS-001"}
+
+    results = await asyncio.gather(*(cache.get_or_compute_bus_eta("BUS-001", 1, compute) for _ in range(5)))
+
+    assert calls == 1
+    assert all(result == {"bus_number": "BUS-001"} for result in results)
+    assert cache.get_cached_bus_eta("BUS-001", 1) == {"bus_number": "BUS-001"}
+    assert not cache._bus_eta_locks
+
+
+@pytest.mark.anyio
+async def test_get_or_compute_bus_eta_after_failed_compute():
+    """Test that a failed computation never lets two computations overlap."""
+    calls = 0
+    active = 0
+    max_active = 0
+
+    async def compute():
+        nonlocal calls, active, max_active
+        calls += 1
+        active += 1
+        max_active = max(max_active, active)
+        try:
+            await asyncio.sleep(0.01)
+            if calls == 1:
+                raise ValueError("Bus not found")
+            return {"bus_number": "BUS-001"}
+        finally:
+            active -= 1
+
+    first = asyncio.create_task(cache.get_or_compute_bus_eta("BUS-001", 1, compute))
+    waiters = [asyncio.create_task(cache.get_or_compute_bus_eta("BUS-001", 1, compute)) for _ in range(2)]
+
+    with pytest.raises(ValueError):
+        await first
+    # Arrives while the queued waiters are still retrying the computation.
+    late = asyncio.create_task(cache.get_or_compute_bus_eta("BUS-001", 1, compute))
+    results = await asyncio.gather(*waiters, late)
+
+    assert max_active == 1
+    assert calls == 2
+    assert all(result == {"bus_number": "BUS-001"} for result in results)
+    assert not cache._bus_eta_locks
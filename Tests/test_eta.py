@@ -0,0 +1,72 @@
+"""
+Unit tests for ETA formatting and calculation helpers.
+"""
+
+import asyncio
+
+import pytest
+
+from routers import eta
+from routers.eta import format_eta_time, get_route_transfer
+
+
+@pytest.mark.parametrize("eta_minutes, expected", [
+    (-3, "0 minutes"),
+    (0, "0 minutes"),
+    (1, "1 minute"),
+    (8, "8 minutes"),
+    (59, "59 minutes"),
+    (60, "1 hour"),
+    (61, "1 hour 1 min"),
+    (150, "2 hours 30 min"),
+    (1440, "1 day"),
+    (4320, "3 days"),
+    (10080, "1 week"),
+    (30240, "3 weeks"),
+])
+def test_format_eta_time(eta_minutes, expected):
+    """Test human-readable ETA strings across unit boundaries."""
+    assert format_eta_time(eta_minutes) == f"Estimated arrival time: {expected}"
+
+
+def test_route_transfer_reports_route_changes(monkeypatch):
+    """Test that linked routes report their transfer count, others the id difference."""
+    monkeypatch.setattr(eta, "route_transfers", {(1, 5): (1, 120)})
+
+    assert get_route_transfer(1, 5) == (1, 120)
+    assert get_route_transfer(1, 3) == (2, eta.calculate_eta_different_route(2))
+    assert get_route_transfer(2, 2) == (0, 0)
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.mark.anyio
+async def test_stop_cache_miss_uses_request_session_when_slots_are_taken(monkeypatch):
+    """Test that no second connection is checked out once every extra slot is in use."""
+    request_db = object()
+    sessions_used = []
+
+    async def fake_get_route_stops(db, route_id):
+        sessions_used.append(db)
+        return "stops"
+
+    async def fake_get_bus_locations(db, bus_id):
+        sessions_used.append(db)
+        return ["location"]
+
+    def fail_session_scope():
+        raise AssertionError("checked out a second connection")
+
+    monkeypatch.setattr(eta, "get_cached_route_stops", lambda route_id: None)
+    monkeypatch.setattr(eta, "get_route_stops", fake_get_route_stops)
+    monkeypatch.setattr(eta, "get_bus_locations", fake_get_bus_locations)
+    monkeypatch.setattr(eta, "session_scope", fail_session_scope)
+    monkeypatch.setattr(eta, "_extra_session_slots", asyncio.Semaphore(0))
+
+    result = await eta.get_route_stops_and_locations(request_db, 1, 1)
+
+    assert result == ("stops", ["location"])
+    assert sessions_used == [request_db, request_db]
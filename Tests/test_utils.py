@@ -0,0 +1,302 @@
+"""
+Unit tests for the geospatial utility functions.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from config import DEFAULT_SPEED_KMH
+from models import BusLocation, Stop
+from utils import (
+    RouteStops,
+    haversine_distance,
+    haversine_distances,
+    haversine_pairwise,
+    calculate_bearing,
+    calculate_speed_kmh,
+    find_next_stop_index,
+    find_stop_index_by_order,
+    calculate_route_distance_to_stop,
+    is_bus_approaching,
+    is_bus_approaching_stops,
+    format_distance,
+    estimate_arrival_time,
+    estimate_arrival_times,
+    estimate_fleet_etas,
+    compute_rolling_average_speed,
+    build_route_transfer_counts
+)
+
+
+def make_stops(coordinates):
+    """Build transient Stop objects from (latitude, longitude) pairs."""
+    return [
+        Stop(stop_id=i + 1, stop_name=f"Stop {i + 1}", stop_order=i + 1, latitude=lat, longitude=lon)
+        for i, (lat, lon) in enumerate(coordinates)
+    ]
+
+
+STOP_COORDINATES = [
+    (40.7128, -74.0060),
+    (40.7074, -74.0113),
+    (40.7580, -73.9855),
+    (40.7527, -73.9772),
+    (40.7505, -73.9934),
+]
+
+
+def test_haversine_distance_same_point():
+    """Test that identical points are zero kilometres apart."""
+    assert haversine_distance(40.7128, -74.0060, 40.7128, -74.0060) == 0.0
+
+
+def test_haversine_distances_matches_scalar():
+    """Test the one-to-many distance helper against the scalar formula."""
+    lats = [lat for lat, _ in STOP_COORDINATES]
+    lons = [lon for _, lon in STOP_COORDINATES]
+
+    distances = haversine_distances(40.7300, -73.9970, lats, lons)
+
+    assert len(distances) == len(STOP_COORDINATES)
+    for distance, (lat, lon) in zip(distances, STOP_COORDINATES):
+        assert distance == pytest.approx(haversine_distance(40.7300, -73.9970, lat, lon))
+
+
+def test_haversine_pairwise_matches_scalar():
+    """Test the pairwise distance helper against the scalar formula."""
+    lats = [lat for lat, _ in STOP_COORDINATES]
+    lons = [lon for _, lon in STOP_COORDINATES]
+
+    distances = haversine_pairwise(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+    assert len(distances) == len(STOP_COORDINATES) - 1
+    for i, distance in enumerate(distances):
+        assert distance == pytest.approx(haversine_distance(lats[i], lons[i], lats[i + 1], lons[i + 1]))
+
+
+def test_calculate_route_distance_to_stop():
+    """Test the distance along the route from the bus to a later stop."""
+    stops = make_stops(STOP_COORDINATES)
+    current_lat, current_lon = 40.7127, -74.0061
+
+    expected = haversine_distance(current_lat, current_lon, *STOP_COORDINATES[0])
+    for (lat1, lon1), (lat2, lon2) in zip(STOP_COORDINATES[:3], STOP_COORDINATES[1:4]):
+        expected += haversine_distance(lat1, lon1, lat2, lon2)
+
+    assert calculate_route_distance_to_stop(stops, 3, current_lat, current_lon) == pytest.approx(expected)
+    assert calculate_route_distance_to_stop(RouteStops(stops), 3, current_lat, current_lon) == pytest.approx(expected)
+    assert calculate_route_distance_to_stop(stops, 3, current_lat, current_lon, current_stop_index=0) == pytest.approx(expected)
+    # Target already passed: straight-line distance back to it.
+    assert calculate_route_distance_to_stop(stops, 0, 40.7579, -73.9856) == pytest.approx(
+        haversine_distance(40.7579, -73.9856, *STOP_COORDINATES[0])
+    )
+    assert calculate_route_distance_to_stop(stops, 99, current_lat, current_lon) == 0.0
+
+
+def test_calculate_bearing_cardinal_directions():
+    """Test bearings due north, east, south and west."""
+    assert calculate_bearing(40.0, -74.0, 41.0, -74.0) == pytest.approx(0.0)
+    assert calculate_bearing(0.0, -74.0, 0.0, -73.0) == pytest.approx(90.0)
+    assert calculate_bearing(40.0, -74.0, 39.0, -74.0) == pytest.approx(180.0)
+    assert calculate_bearing(0.0, -74.0, 0.0, -75.0) == pytest.approx(270.0)
+    # A tiny negative angle must wrap to 0, not 360.
+    assert calculate_bearing(40.0, 0.0, 41.0, -1e-16) == 0.0
+
+
+def test_find_next_stop_index_returns_closest_stop():
+    """Test that the closest stop is selected."""
+    stops = make_stops(STOP_COORDINATES)
+
+    assert find_next_stop_index(stops, 40.7579, -73.9856) == 2
+    assert find_next_stop_index(stops, 40.7128, -74.0060) == 0
+
+
+def test_find_next_stop_index_accepts_route_stops():
+    """Test that the cached stop arrays give the same answer as Stop lists."""
+    stops = make_stops(STOP_COORDINATES)
+    route_stops = RouteStops(stops)
+
+    assert len(route_stops) == len(stops)
+    assert route_stops.orders == (1, 2, 3, 4, 5)
+    assert route_stops.order_index == {1: 0, 2: 1, 3: 2, 4: 3, 5: 4}
+    assert route_stops.distance_km_to(3, 40.7300, -73.9970) == pytest.approx(
+        haversine_distance(40.7300, -73.9970, *STOP_COORDINATES[3])
+    )
+    assert route_stops.cumulative_km[0] == 0.0
+    assert route_stops.cumulative_km[2] == pytest.approx(
+        haversine_distance(*STOP_COORDINATES[0], *STOP_COORDINATES[1])
+        + haversine_distance(*STOP_COORDINATES[1], *STOP_COORDINATES[2])
+    )
+    assert route_stops.route_distance_km(2, 3) == pytest.approx(
+        haversine_distance(*STOP_COORDINATES[2], *STOP_COORDINATES[3])
+    )
+    assert route_stops.route_distance_km(3, 1) == pytest.approx(-route_stops.route_distance_km(1, 3))
+    for lat, lon in [(40.7579, -73.9856), (40.7075, -74.0110), (40.7510, -73.9900)]:
+        assert find_next_stop_index(route_stops, lat, lon) == find_next_stop_index(stops, lat, lon)
+
+
+def test_find_next_stop_index_with_hint():
+    """Test that a stop hint narrows the search but never strands the bus."""
+    route_stops = RouteStops(make_stops(STOP_COORDINATES))
+
+    # Within the hint window and radius.
+    assert find_next_stop_index(route_stops, 40.7579, -73.9856, hint=1) == 2
+    # Bus is back near the first stop, outside the window: full scan.
+    assert find_next_stop_index(route_stops, 40.7128, -74.0060, hint=2) == 0
+    # Out-of-range hints are ignored.
+    assert find_next_stop_index(route_stops, 40.7579, -73.9856, hint=99) == 2
+
+
+def test_find_stop_index_by_order():
+    """Test stop_order lookups on cached stop arrays and plain Stop lists."""
+    stops = make_stops(STOP_COORDINATES)[1:]
+
+    assert find_stop_index_by_order(RouteStops(stops), 4) == 2
+    assert find_stop_index_by_order(stops, 4) == 2
+    assert find_stop_index_by_order(RouteStops(stops), 1) is None
+    assert find_stop_index_by_order(stops, 1) is None
+
+
+def test_find_next_stop_index_empty_route():
+    """Test that an empty route falls back to index 0."""
+    assert find_next_stop_index([], 40.7128, -74.0060) == 0
+
+
+def test_is_bus_approaching():
+    """Test that moving towards a stop counts as approaching and away does not."""
+    assert is_bus_approaching(40.7000, -74.0000, 40.7100, -74.0000, 40.7200, -74.0000)
+    assert not is_bus_approaching(40.7100, -74.0000, 40.7000, -74.0000, 40.7200, -74.0000)
+    assert not is_bus_approaching(40.7100, -74.0000, 40.7100, -74.0000, 40.7200, -74.0000)
+
+
+def test_nearest_stop_and_approach_across_antimeridian():
+    """Test that stops just across the antimeridian count as close."""
+    stops = make_stops([(-17.0000, 179.9500), (-17.0000, 179.0000)])
+
+    assert find_next_stop_index(stops, -17.0000, -179.9800) == 0
+    # Moving west from -179.90 to -179.98 closes in on the stop at 179.95.
+    assert is_bus_approaching(-17.0000, -179.9000, -17.0000, -179.9800, -17.0000, 179.9500)
+    assert is_bus_approaching_stops(
+        -17.0000, -179.9000, -17.0000, -179.9800, RouteStops(stops)
+    ) == [True, True]
+
+
+def test_is_bus_approaching_stops_matches_scalar():
+    """Test the all-stops check against is_bus_approaching per stop."""
+    lats = [lat for lat, _ in STOP_COORDINATES]
+    lons = [lon for _, lon in STOP_COORDINATES]
+    prev_lat, prev_lon, curr_lat, curr_lon = 40.7300, -73.9970, 40.7400, -73.9920
+
+    approaching = is_bus_approaching_stops(
+        prev_lat, prev_lon, curr_lat, curr_lon, RouteStops(make_stops(STOP_COORDINATES))
+    )
+
+    assert approaching == [
+        is_bus_approaching(prev_lat, prev_lon, curr_lat, curr_lon, lat, lon)
+        for lat, lon in STOP_COORDINATES
+    ]
+    assert True in approaching and False in approaching
+
+    # Near-tie where scaling by the bus's latitude instead of the stop's flips the answer.
+    prev_lat, prev_lon = 20.215320980567853, -65.81328796220618
+    curr_lat, curr_lon = 20.20336239832315, -65.82795774597167
+    stop_lat, stop_lon = 20.16505518079662, -65.77963929001052
+    assert is_bus_approaching_stops(
+        prev_lat, prev_lon, curr_lat, curr_lon, RouteStops(make_stops([(stop_lat, stop_lon)]))
+    ) == [is_bus_approaching(prev_lat, prev_lon, curr_lat, curr_lon, stop_lat, stop_lon)]
+
+
+def test_format_distance():
+    """Test metre, tenth-of-a-kilometre and whole-kilometre labels."""
+    assert format_distance(0.532) == "532 m"
+    assert format_distance(1.0) == "1.0 km"
+    assert format_distance(3.46) == "3.5 km"
+    assert format_distance(9.99) == "10.0 km"
+    # Half-tenth boundaries round like f"{distance_km:.1f}".
+    for distance_km in (1.05, 1.15, 2.25, 4.35, 9.95):
+        assert format_distance(distance_km) == f"{distance_km:.1f} km"
+    assert format_distance(12.7) == "12 km"
+
+
+def test_estimate_arrival_times_matches_scalar():
+    """Test the batch ETA helper against estimate_arrival_time per distance."""
+    distances = [0.0, 0.1, 0.5, 2.0, 7.3, 25.0]
+
+    assert estimate_arrival_times(distances, 20.0) == [
+        estimate_arrival_time(distance, 20.0) for distance in distances
+    ]
+    assert estimate_arrival_times(distances, 0.0) == [60] * len(distances)
+
+
+def test_estimate_fleet_etas_matches_route_distances():
+    """Test fleet ETAs against per-stop route distances for each bus."""
+    stops = make_stops(STOP_COORDINATES)
+    route_stops = RouteStops(stops)
+    positions = [(40.7127, -74.0061), (40.7579, -73.9856)]
+    speeds = [20.0, 30.0]
+
+    etas = estimate_fleet_etas(route_stops, positions, speeds)
+
+    assert len(etas) == len(positions)
+    for row, (lat, lon), speed in zip(etas, positions, speeds):
+        assert row == [
+            estimate_arrival_time(calculate_route_distance_to_stop(stops, index, lat, lon), speed)
+            for index in range(len(stops))
+        ]
+
+
+def test_compute_rolling_average_speed():
+    """Test the average speed over newest-first location samples."""
+    now = datetime.now(timezone.utc)
+    locations = [
+        BusLocation(bus_id=1, latitude=40.7200, longitude=-74.0000, recorded_at=now),
+        BusLocation(bus_id=1, latitude=40.7100, longitude=-74.0000, recorded_at=now - timedelta(minutes=2)),
+        BusLocation(bus_id=1, latitude=40.7000, longitude=-74.0000, recorded_at=now - timedelta(minutes=4)),
+    ]
+
+    leg_km = haversine_distance(40.7000, -74.0000, 40.7100, -74.0000)
+    expected_kmh = leg_km / (2 / 60)
+
+    assert compute_rolling_average_speed(locations) == pytest.approx(expected_kmh)
+    assert compute_rolling_average_speed(locations[:1]) == DEFAULT_SPEED_KMH
+
+
+def test_compute_rolling_average_speed_matches_pairwise_speeds():
+    """Test the single-pass average against per-pair calculate_speed_kmh."""
+    now = datetime.now(timezone.utc)
+    samples = [
+        (40.7128, -74.0060, now),
+        (40.7135, -74.0040, now - timedelta(seconds=30)),
+        (40.7150, -74.0010, now - timedelta(seconds=30)),
+        (40.7300, -73.9900, now - timedelta(minutes=3)),
+        (40.7310, -73.9890, now - timedelta(minutes=5)),
+    ]
+    locations = [
+        BusLocation(bus_id=1, latitude=lat, longitude=lon, recorded_at=recorded_at)
+        for lat, lon, recorded_at in samples
+    ]
+
+    chrono = samples[::-1]
+    speeds = [
+        calculate_speed_kmh(*older, *newer)
+        for older, newer in zip(chrono, chrono[1:])
+    ]
+
+    assert compute_rolling_average_speed(locations) == pytest.approx(sum(speeds) / len(speeds))
+
+
+def test_build_route_transfer_counts():
+    """Test transfer counts between routes linked by shared stop names."""
+    transfer_counts = build_route_transfer_counts({
+        1: ["Central Station", "Times Square"],
+        2: ["Times Square", "Grand Central"],
+        3: ["Grand Central", "Airport"],
+        4: ["Harbour"],
+    })
+
+    assert transfer_counts[(1, 2)] == 1
+    assert transfer_counts[(1, 3)] == 2
+    assert transfer_counts[(3, 1)] == 2
+    assert (1, 1) not in transfer_counts
+    assert not any(4 in route_pair for route_pair in transfer_counts)
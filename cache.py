@@ -2,120 +2,252 @@
 Caching utilities for ETA and frequently accessed data.
 """
 
-from datetime import datetime, timezone
-from typing import Optional, List, Dict, Tuple, Any
+import asyncio
+import time
+from typing import Optional, List, Dict, Tuple, Any, Callable, Awaitable
 import logging
 
-from config import CACHE_TTL_SECONDS
+from config import CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES, ROUTE_STOPS_CACHE_TTL_SECONDS
 from schemas import ETAResponse
+from utils import RouteStops
 
 logger = logging.getLogger(__name__)
 
-# Cache storage
-eta_cache: Dict[str, Tuple[List[ETAResponse], datetime]] = {}
-general_cache: Dict[str, Tuple[Any, datetime]] = {}
+# Cache storage: key -> (data, expires_at) where expires_at is on the
+# time.monotonic() clock, so a hit is a single float comparison.
+# ETA entries are keyed by stop_id and bus ETA entries by (bus_number, route_id)
+# so lookups hash the values directly instead of formatting a key string.
+eta_cache: Dict[int, Tuple[List[ETAResponse], float]] = {}
+general_cache: Dict[Tuple[str, int], Tuple[Any, float]] = {}
 
+# Route stops rarely change, so they are kept much longer than ETA results.
+route_stops_cache: Dict[int, Tuple[RouteStops, float]] = {}
 
-def get_cache_key(stop_id: int) -> str:
-    """Generate a cache key for a stop ID."""
-    return f"eta_{stop_id}"
+# Last nearest-stop index per (bus_id, route_id), used to narrow the next search.
+bus_stop_hints: Dict[Tuple[int, int], int] = {}
 
 
-def get_bus_cache_key(bus_number: str, route_id: int) -> str:
-    """Generate a cache key for bus ETA."""
-    return f"bus_eta_{bus_number}_{route_id}"
+class _KeyLock:
+    """A lock plus the number of tasks holding or waiting on it."""
+    
+    __slots__ = ("lock", "users")
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+# One lock per bus ETA key being computed, so concurrent misses wait for a
+# single computation instead of all hitting the database.
+_bus_eta_locks: Dict[Tuple[str, int], _KeyLock] = {}
+
+
+def _store(
+    cache: Dict[Any, Tuple[Any, float]],
+    key: Any,
+    data: Any,
+    ttl_seconds: int = CACHE_TTL_SECONDS
+) -> None:
+    """Insert an entry, evicting the oldest one when the cache is full."""
+    if key not in cache and len(cache) >= CACHE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)), None)
+    cache[key] = (data, time.monotonic() + ttl_seconds)
 
 
 def get_cached_eta(stop_id: int) -> Optional[List[ETAResponse]]:
     """Retrieve cached ETA data for a stop."""
-    cache_key = get_cache_key(stop_id)
+    entry = eta_cache.get(stop_id)
     
-    if cache_key in eta_cache:
-        cached_data, cached_time = eta_cache[cache_key]
-        age_seconds = (datetime.now(timezone.utc) - cached_time).total_seconds()
+    if entry is not None:
+        cached_data, expires_at = entry
         
-        if age_seconds < CACHE_TTL_SECONDS:
-            logger.debug(f"Cache hit for {cache_key}")
+        if time.monotonic() < expires_at:
+            logger.debug("Cache hit for stop %s", stop_id)
             return cached_data
         
-        del eta_cache[cache_key]
+        eta_cache.pop(stop_id, None)
     
     return None
 
 
 def set_cached_eta(stop_id: int, data: List[ETAResponse]) -> None:
     """Store ETA data in cache."""
-    cache_key = get_cache_key(stop_id)
-    eta_cache[cache_key] = (data, datetime.now(timezone.utc))
-    logger.debug(f"Cached data for {cache_key}")
+    _store(eta_cache, stop_id, data)
+    logger.debug("Cached data for stop %s", stop_id)
 
 
 def get_cached_bus_eta(bus_number: str, route_id: int) -> Optional[Dict]:
     """Retrieve cached bus ETA data."""
-    cache_key = get_bus_cache_key(bus_number, route_id)
+    cache_key = (bus_number, route_id)
+    entry = general_cache.get(cache_key)
     
-    if cache_key in general_cache:
-        cached_data, cached_time = general_cache[cache_key]
-        age_seconds = (datetime.now(timezone.utc) - cached_time).total_seconds()
+    if entry is not None:
+        cached_data, expires_at = entry
         
-        if age_seconds < CACHE_TTL_SECONDS:
+        if time.monotonic() < expires_at:
             return cached_data
         
-        del general_cache[cache_key]
+        general_cache.pop(cache_key, None)
     
     return None
 
 
 def set_cached_bus_eta(bus_number: str, route_id: int, data: Dict) -> None:
     """Store bus ETA data in cache."""
-    cache_key = get_bus_cache_key(bus_number, route_id)
-    general_cache[cache_key] = (data, datetime.now(timezone.utc))
+    _store(general_cache, (bus_number, route_id), data)
+
+
+async def get_or_compute_bus_eta(
+    bus_number: str,
+    route_id: int,
+    compute: Callable[[], Awaitable[Dict]]
+) -> Dict:
+    """Return the cached bus ETA, computing it at most once per key on a miss."""
+    cached = get_cached_bus_eta(bus_number, route_id)
+    if cached is not None:
+        return cached
+    
+    cache_key = (bus_number, route_id)
+    key_lock = _bus_eta_locks.get(cache_key)
+    if key_lock is None:
+        key_lock = _bus_eta_locks[cache_key] = _KeyLock()
+    key_lock.users += 1
+    
+    try:
+        async with key_lock.lock:
+            cached = get_cached_bus_eta(bus_number, route_id)
+            if cached is not None:
+                return cached
+            
+            data = await compute()
+            set_cached_bus_eta(bus_number, route_id, data)
+            return data
+    finally:
+        # The lock is released before queued waiters run, so locked() cannot
+        # tell whether anyone still needs it. Only drop the entry once no
+        # task holds or waits on it; otherwise a failed compute would let a
+        # new request start a second computation beside a woken waiter.
+        key_lock.users -= 1
+        if key_lock.users == 0:
+            del _bus_eta_locks[cache_key]
+
+
+def invalidate_bus(bus_number: str) -> None:
+    """Drop cached ETA entries for a bus, e.g. after its location changes."""
+    stale_keys = [key for key in list(general_cache) if key[0] == bus_number]
+    for key in stale_keys:
+        general_cache.pop(key, None)
+
+
+def get_cached_route_stops(route_id: int) -> Optional[RouteStops]:
+    """Retrieve the cached stop arrays for a route."""
+    entry = route_stops_cache.get(route_id)
+    
+    if entry is not None:
+        route_stops, expires_at = entry
+        
+        if time.monotonic() < expires_at:
+            return route_stops
+        
+        route_stops_cache.pop(route_id, None)
+    
+    return None
+
+
+def set_cached_route_stops(route_id: int, route_stops: RouteStops) -> None:
+    """Store the stop arrays for a route."""
+    _store(route_stops_cache, route_id, route_stops, ROUTE_STOPS_CACHE_TTL_SECONDS)
+
+
+def invalidate_route_stops(route_id: int) -> None:
+    """Drop the cached stops for a route after its stops are edited."""
+    route_stops_cache.pop(route_id, None)
+
+
+def get_bus_stop_hint(bus_id: int, route_id: int) -> Optional[int]:
+    """Retrieve the last nearest-stop index seen for a bus on a route."""
+    return bus_stop_hints.get((bus_id, route_id))
+
+
+def set_bus_stop_hint(bus_id: int, route_id: int, stop_index: int) -> None:
+    """Remember the nearest-stop index for a bus on a route."""
+    key = (bus_id, route_id)
+    if key not in bus_stop_hints and len(bus_stop_hints) >= CACHE_MAX_ENTRIES:
+        del bus_stop_hints[next(iter(bus_stop_hints))]
+    bus_stop_hints[key] = stop_index
 
 
 def clear_eta_cache() -> None:
     """Clear all ETA-related cache entries."""
-    cache_keys_to_clear = [key for key in eta_cache.keys() if key.startswith("eta_")]
-    for key in cache_keys_to_clear:
-        del eta_cache[key]
-    logger.info(f"Cleared {len(cache_keys_to_clear)} ETA cache entries")
+    cleared_count = len(eta_cache)
+    eta_cache.clear()
+    logger.info("Cleared %s ETA cache entries", cleared_count)
 
 
 def clear_all_cache() -> None:
     """Clear all cache entries."""
     eta_cache.clear()
     general_cache.clear()
+    route_stops_cache.clear()
+    bus_stop_hints.clear()
     logger.info("Cleared all cache entries")
 
 
-def cleanup_expired_cache() -> int:
-    """Remove expired entries from all caches."""
-    now = datetime.now(timezone.utc)
-    removed_count = 0
+def collect_expired_entries() -> List[Tuple[Dict[Any, Tuple[Any, float]], Any, Tuple[Any, float]]]:
+    """
+    Find expired entries in all caches without modifying them.
     
-    expired_keys = [
-        key for key, (_, cached_time) in eta_cache.items()
-        if (now - cached_time).total_seconds() >= CACHE_TTL_SECONDS
-    ]
-    for key in expired_keys:
-        del eta_cache[key]
-        removed_count += 1
+    Only reads snapshots of each cache's items, so it is safe to run in a
+    worker thread while requests keep using the caches.
+    """
+    now = time.monotonic()
     
-    expired_keys = [
-        key for key, (_, cached_time) in general_cache.items()
-        if (now - cached_time).total_seconds() >= CACHE_TTL_SECONDS
+    return [
+        (cache, key, entry)
+        for cache in (eta_cache, general_cache, route_stops_cache)
+        for key, entry in list(cache.items())
+        if now >= entry[1]
     ]
-    for key in expired_keys:
-        del general_cache[key]
-        removed_count += 1
+
+
+def remove_expired_entries(
+    expired: List[Tuple[Dict[Any, Tuple[Any, float]], Any, Tuple[Any, float]]]
+) -> int:
+    """
+    Remove entries found by collect_expired_entries that are still in place.
+    
+    An entry a request has replaced or removed since the scan is left
+    alone. Must run on the event loop, so no request can replace an entry
+    between the identity check and the delete.
+    """
+    removed_count = 0
+    
+    for cache, key, entry in expired:
+        if cache.get(key) is entry:
+            del cache[key]
+            removed_count += 1
     
     return removed_count
 
 
+def cleanup_expired_cache() -> int:
+    """Remove expired entries from all caches."""
+    return remove_expired_entries(collect_expired_entries())
+
+
 def get_cache_stats() -> Dict[str, Any]:
     """Get statistics about the cache."""
+    # len() on a dict reads its stored entry count, so separate size counters
+    # would only duplicate it; each size is read once here.
+    eta_entries = len(eta_cache)
+    general_entries = len(general_cache)
+    route_stops_entries = len(route_stops_cache)
+    
     return {
-        "eta_cache_entries": len(eta_cache),
-        "general_cache_entries": len(general_cache),
-        "total_entries": len(eta_cache) + len(general_cache),
-        "ttl_seconds": CACHE_TTL_SECONDS
+        "eta_cache_entries": eta_entries,
+        "general_cache_entries": general_entries,
+        "route_stops_entries": route_stops_entries,
+        "total_entries": eta_entries + general_entries + route_stops_entries,
+        "ttl_seconds": CACHE_TTL_SECONDS,
+        "max_entries": CACHE_MAX_ENTRIES
     }
@@ -6,15 +6,23 @@ session management utilities for database operations.
 """
 
 import logging
+import time
+from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy import text
-from typing import AsyncGenerator
+from sqlalchemy import event, text
+from sqlalchemy.exc import DisconnectionError
+from typing import AsyncGenerator, AsyncIterator
 
 from config import (
     DATABASE_URL, 
     DB_POOL_SIZE, 
     DB_MAX_OVERFLOW, 
     DB_POOL_TIMEOUT,
+    DB_QUERY_CACHE_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_IDLE_PING_SECONDS,
+    DB_CONNECT_TIMEOUT,
+    DB_APPLICATION_NAME,
     SCHEMA_NAME
 )
 from models import Base
@@ -25,13 +33,47 @@ logger = logging.getLogger(__name__)
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,
-    pool_pre_ping=True,
+    pool_pre_ping=False,
     pool_size=DB_POOL_SIZE,
     max_overflow=DB_MAX_OVERFLOW,
     pool_timeout=DB_POOL_TIMEOUT,
-    pool_recycle=3600
+    pool_recycle=3600,
+    pool_use_lifo=True,
+    query_cache_size=DB_QUERY_CACHE_SIZE,
+    connect_args={
+        "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "server_settings": {"application_name": DB_APPLICATION_NAME},
+        "timeout": DB_CONNECT_TIMEOUT
+    }
 )
 
+
+@event.listens_for(engine.sync_engine.pool, "checkin")
+def _record_checkin_time(dbapi_connection, connection_record):
+    connection_record.info["checked_in_at"] = time.monotonic()
+
+
+@event.listens_for(engine.sync_engine.pool, "checkout")
+def _warn_on_pool_exhaustion(dbapi_connection, connection_record, connection_proxy):
+    pool = engine.sync_engine.pool
+    if pool.checkedout() >= DB_POOL_SIZE + DB_MAX_OVERFLOW:
+        logger.warning("Connection pool exhausted: %s", pool.status())
+
+
+@event.listens_for(engine.sync_engine.pool, "checkout")
+def _ping_idle_connection(dbapi_connection, connection_record, connection_proxy):
+    """Ping a connection on checkout only if it sat idle in the pool for a while."""
+    checked_in_at = connection_record.info.get("checked_in_at")
+    if checked_in_at is None or time.monotonic() - checked_in_at < DB_IDLE_PING_SECONDS:
+        return
+    
+    try:
+        dbapi_connection.ping()
+    except Exception as e:
+        # The pool discards the connection and retries with a fresh one
+        raise DisconnectionError(f"Idle connection failed ping: {e}") from e
+
 # Session factory
 SessionLocal = async_sessionmaker(
     engine,
@@ -49,15 +91,26 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
     Yields:
         AsyncSession: Database session for the request
     """
+    session = SessionLocal()
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    Provide an extra session for work that runs alongside the request session.
+    
+    An AsyncSession cannot run two queries at once, so concurrent queries
+    each need their own session.
+    """
     async with SessionLocal() as session:
-        try:
-            yield session
-        except Exception as e:
-            logger.error(f"Database session error: {e}")
-            await session.rollback()
-            raise
-        finally:
-            await session.close()
+        yield session
 
 
 async def check_database_connection() -> bool:
@@ -72,27 +125,28 @@ async def check_database_connection() -> bool:
             await conn.execute(text("SELECT 1"))
         return True
     except Exception as e:
-        logger.error(f"Database health check failed: {e}")
+        logger.error("Database health check failed: %s", e)
         return False
 
 
 async def init_db() -> None:
     """
     Initialize the database schema and tables.
+    
+    Failures are logged and re-raised so the application does not start
+    serving requests against a missing or broken schema.
     """
     try:
         async with engine.begin() as conn:
             await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA_NAME}"))
-            logger.info(f"Schema \'{SCHEMA_NAME}\' ensured")
-
-        async with engine.begin() as conn:
+            logger.info("Schema '%s' ensured", SCHEMA_NAME)
             await conn.run_sync(Base.metadata.create_all)
             logger.info("Database tables created/verified")
-
-        logger.info("Database initialized successfully")
-        
-    except Exception as e:
-        logger.warning(f"Database initialization warning: {e}")
+    except Exception:
+        logger.exception("Database initialization failed")
+        raise
+    
+    logger.info("Database initialized successfully")
 
 
 async def dispose_db() -> None:
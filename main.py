@@ -6,26 +6,30 @@ import logging
 import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 import time
 
 from config import (
     API_TITLE, 
     API_VERSION, 
     API_DESCRIPTION,
-    GZIP_MINIMUM_SIZE, 
     LOG_LEVEL, 
     LOG_FORMAT,
     LOG_DATE_FORMAT,
     CORS_ORIGINS,
     CORS_ALLOW_CREDENTIALS,
-    CACHE_CLEANUP_INTERVAL
+    CACHE_CLEANUP_INTERVAL,
+    CACHE_CLEANUP_BUSY_THRESHOLD,
+    INFO_CACHE_TTL_SECONDS,
+    SERVER_LOOP,
+    SERVER_HTTP,
+    SERVER_WORKERS,
+    SERVER_RELOAD
 )
-from database import init_db, dispose_db, check_database_connection
+from database import init_db, dispose_db, check_database_connection, session_scope
 from routers import locations, routes, eta, health
-from cache import cleanup_expired_cache
+from responses import ORJSONResponse
 
 # Configure logging
 logging.basicConfig(
@@ -33,39 +37,77 @@ logging.basicConfig(
     format=LOG_FORMAT,
     datefmt=LOG_DATE_FORMAT
 )
+# LOG_FORMAT never shows thread, process or task names, so skip collecting them
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logging.logAsyncioTasks = False
 logger = logging.getLogger(__name__)
 
 
 async def periodic_cache_cleanup():
-    """Background task to periodically clean up expired cache entries."""
+    """
+    Background task to periodically clean up expired cache entries.
+    
+    The scan runs in a worker thread so it never blocks the event loop;
+    deletions happen back on the loop and skip entries re-set meanwhile.
+    The interval doubles while nothing expires and halves after a busy
+    cleanup, within a quarter to four times CACHE_CLEANUP_INTERVAL.
+    """
+    from cache import collect_expired_entries, remove_expired_entries
+    
+    min_interval = CACHE_CLEANUP_INTERVAL / 4
+    max_interval = CACHE_CLEANUP_INTERVAL * 4
+    sleep_for = CACHE_CLEANUP_INTERVAL
+    
     while True:
-        await asyncio.sleep(CACHE_CLEANUP_INTERVAL)
+        await asyncio.sleep(sleep_for)
         try:
-            removed = cleanup_expired_cache()
-            if removed > 0:
-                logger.debug(f"Cache cleanup: {removed} entries removed")
+            expired = await asyncio.to_thread(collect_expired_entries)
+            removed = remove_expired_entries(expired)
         except Exception as e:
-            logger.error(f"Cache cleanup error: {e}")
+            logger.error("Cache cleanup error: %s", e)
+            continue
+        
+        if removed > 0:
+            logger.debug("Cache cleanup: %s entries removed", removed)
+        
+        if removed == 0:
+            sleep_for = min(sleep_for * 2, max_interval)
+        elif removed > CACHE_CLEANUP_BUSY_THRESHOLD:
+            sleep_for = max(sleep_for / 2, min_interval)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager."""
-    logger.info(f"Starting {API_TITLE} v{API_VERSION}")
+    logger.info("Starting %s v%s", API_TITLE, API_VERSION)
     
-    await init_db()
+    try:
+        await init_db()
+    except Exception:
+        # Release the pool and let startup fail so the worker is restarted
+        await dispose_db()
+        raise
     
     if await check_database_connection():
         logger.info("Database connection verified")
     else:
         logger.warning("Database connection check failed")
     
+    try:
+        async with session_scope() as db:
+            transfer_pairs = await eta.load_route_transfer_table(db)
+        logger.info("Route transfer table built: %s connected route pairs", transfer_pairs)
+    except Exception as e:
+        logger.warning("Route transfer table not built, using route-id heuristic: %s", e)
+    
     cleanup_task = asyncio.create_task(periodic_cache_cleanup())
     logger.info("Background tasks started")
     
     yield
     
-    logger.info(f"Shutting down {API_TITLE}")
+    logger.info("Shutting down %s", API_TITLE)
     
     cleanup_task.cancel()
     try:
@@ -83,23 +125,38 @@ app = FastAPI(
     version=API_VERSION,
     description=API_DESCRIPTION,
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json"
 )
 
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    """Add processing time to response headers."""
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = f"{process_time:.4f}"
-    return response
+class ProcessTimeMiddleware:
+    """Add processing time to response headers, as plain ASGI middleware."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter()
+        
+        async def send_with_process_time(message):
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                headers = list(message.get("headers", []))
+                headers.append((b"x-process-time", f"{process_time:.4f}".encode()))
+                message["headers"] = headers
+            await send(message)
+        
+        await self.app(scope, receive, send_with_process_time)
 
 
-app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+app.add_middleware(ProcessTimeMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -110,11 +167,22 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """Fail fast with 503 when no database connection is free."""
+    logger.warning("Database pool timeout on %s", request.url.path)
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Service temporarily unavailable, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler."""
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "An internal server error occurred", "type": type(exc).__name__}
     )
@@ -144,22 +212,46 @@ async def root():
     }
 
 
+# Last /info snapshot and when it expires (time.monotonic() clock)
+_info_cache = {"expires_at": 0.0, "value": None}
+_info_lock = asyncio.Lock()
+
+
 @app.get("/info", tags=["root"])
 async def api_info():
     """Get detailed API information."""
-    from cache import get_cache_stats
-    from database import get_db_stats
+    if time.monotonic() < _info_cache["expires_at"]:
+        return _info_cache["value"]
     
-    return {
-        "api": {"title": API_TITLE, "version": API_VERSION},
-        "cache": get_cache_stats(),
-        "database": await get_db_stats()
-    }
+    async with _info_lock:
+        if time.monotonic() < _info_cache["expires_at"]:
+            return _info_cache["value"]
+        
+        from cache import get_cache_stats
+        from database import get_db_stats
+        
+        _info_cache["value"] = {
+            "api": {"title": API_TITLE, "version": API_VERSION},
+            "cache": get_cache_stats(),
+            "database": await get_db_stats()
+        }
+        _info_cache["expires_at"] = time.monotonic() + INFO_CACHE_TTL_SECONDS
+    
+    return _info_cache["value"]
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, log_level="info")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=SERVER_RELOAD,
+        log_level="info",
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        workers=SERVER_WORKERS
+    )
 
 #uvicorn main:app --reload
 
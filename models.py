@@ -3,8 +3,8 @@ SQLAlchemy ORM models for the Public Transport Tracking system.
 """
 
 from sqlalchemy import (
-    Column, BigInteger, Float, Boolean, TIMESTAMP, String,
-    ForeignKey, Index, CheckConstraint
+    Column, Integer, BigInteger, Identity, Float, Boolean, TIMESTAMP, String,
+    ForeignKey, Index, CheckConstraint, DDL, event, text
 )
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime, timezone
@@ -19,25 +19,36 @@ class Bus(Base):
     __tablename__ = "buses"
     __table_args__ = {"schema": SCHEMA_NAME}
 
-    bus_id = Column(BigInteger, primary_key=True, autoincrement=True)
-    bus_number = Column(String(20), nullable=False, unique=True, index=True)
+    bus_id = Column(Integer, Identity(always=True), primary_key=True)
+    # Byte-wise "C" collation: bus numbers are ASCII codes, so lookups skip locale-aware comparison.
+    bus_number = Column(String(20, collation="C"), nullable=False, unique=True, index=True)
     is_active = Column(Boolean, default=True, nullable=False, index=True)
     created_at = Column(
         TIMESTAMP(timezone=True), 
         default=lambda: datetime.now(timezone.utc),
         nullable=False
     )
+    # Latest fix, copied from bus_locations by the trg_bus_locations_last_location
+    # trigger so live reads are a primary-key lookup.
+    last_latitude = Column(Float, nullable=True)
+    last_longitude = Column(Float, nullable=True)
+    last_recorded_at = Column(TIMESTAMP(timezone=True), nullable=True)
 
+    # Location history is only read through explicit, limited queries.
+    # The FK cascades on delete, so the ORM never needs to load it.
     locations = relationship(
         "BusLocation", 
         back_populates="bus", 
         cascade="all, delete-orphan",
-        lazy="dynamic"
+        passive_deletes=True,
+        lazy="raise"
     )
     route_assignments = relationship(
         "BusRoute", 
         back_populates="bus", 
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise"
     )
 
     def __repr__(self):
@@ -49,7 +60,7 @@ class Route(Base):
     __tablename__ = "routes"
     __table_args__ = {"schema": SCHEMA_NAME}
 
-    route_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    route_id = Column(Integer, Identity(always=True), primary_key=True)
     route_name = Column(String(100), nullable=False)
     route_number = Column(String(20), nullable=True, unique=True, index=True)
     created_at = Column(
@@ -62,7 +73,9 @@ class Route(Base):
         "Stop", 
         back_populates="route", 
         order_by="Stop.stop_order", 
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise"
     )
     bus_assignments = relationship(
         "BusRoute", 
@@ -82,9 +95,9 @@ class Stop(Base):
         {"schema": SCHEMA_NAME},
     )
 
-    stop_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    stop_id = Column(Integer, Identity(always=True), primary_key=True)
     route_id = Column(
-        BigInteger, 
+        Integer, 
         ForeignKey(f"{SCHEMA_NAME}.routes.route_id", ondelete="CASCADE"), 
         nullable=False,
         index=True
@@ -92,7 +105,7 @@ class Stop(Base):
     stop_name = Column(String(100), nullable=False)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
-    stop_order = Column(BigInteger, nullable=False)
+    stop_order = Column(Integer, nullable=False)
     created_at = Column(
         TIMESTAMP(timezone=True), 
         default=lambda: datetime.now(timezone.utc),
@@ -109,24 +122,39 @@ class BusLocation(Base):
     """Records a bus location at a specific point in time."""
     __tablename__ = "bus_locations"
     __table_args__ = (
-        Index("idx_bus_location_bus_time", "bus_id", "recorded_at"),
-        Index("idx_bus_location_time", "recorded_at"),
-        {"schema": SCHEMA_NAME},
-    )
-
-    location_id = Column(BigInteger, primary_key=True, autoincrement=True)
+        # Serves "latest N fixes for a bus" without a sort step, and as an
+        # index-only scan when only coordinates and time are selected.
+        Index(
+            "idx_bus_locations_bus_id_recorded_at",
+            "bus_id",
+            text("recorded_at DESC"),
+            postgresql_include=["latitude", "longitude"]
+        ),
+        # Rows arrive in time order, so a BRIN index stays tiny for time-range scans.
+        Index(
+            "idx_bus_location_time",
+            "recorded_at",
+            postgresql_using="brin",
+            postgresql_with={"pages_per_range": 32}
+        ),
+        # Monthly partitions are created by setupdb.py; see README.
+        {"schema": SCHEMA_NAME, "postgresql_partition_by": "RANGE (recorded_at)"},
+    )
+
+    # The only key that grows without bound, so it stays 64-bit.
+    location_id = Column(BigInteger, Identity(always=True), primary_key=True)
     bus_id = Column(
-        BigInteger,
+        Integer,
         ForeignKey(f"{SCHEMA_NAME}.buses.bus_id", ondelete="CASCADE"),
-        nullable=False,
-        index=True
+        nullable=False
     )
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
+    # Part of the primary key because it is the partition key.
     recorded_at = Column(
         TIMESTAMP(timezone=True), 
         default=lambda: datetime.now(timezone.utc), 
-        nullable=False
+        primary_key=True
     )
 
     bus = relationship("Bus", back_populates="locations")
@@ -135,21 +163,61 @@ class BusLocation(Base):
         return f"<BusLocation(bus_id={self.bus_id}, lat={self.latitude}, lon={self.longitude})>"
 
 
+# A partitioned table accepts no rows until it has a partition.
+event.listen(
+    BusLocation.__table__,
+    "after_create",
+    DDL(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_NAME}.bus_locations_default
+        PARTITION OF {SCHEMA_NAME}.bus_locations DEFAULT
+    """).execute_if(dialect="postgresql")
+)
+
+# Keeps the buses.last_* columns in step with newly inserted locations.
+event.listen(
+    BusLocation.__table__,
+    "after_create",
+    DDL(f"""
+        CREATE OR REPLACE FUNCTION {SCHEMA_NAME}.update_bus_last_location() RETURNS trigger AS $$
+        BEGIN
+            UPDATE {SCHEMA_NAME}.buses
+            SET last_latitude = NEW.latitude,
+                last_longitude = NEW.longitude,
+                last_recorded_at = NEW.recorded_at
+            WHERE bus_id = NEW.bus_id
+              AND (last_recorded_at IS NULL OR last_recorded_at <= NEW.recorded_at);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """).execute_if(dialect="postgresql")
+)
+event.listen(
+    BusLocation.__table__,
+    "after_create",
+    DDL(f"""
+        CREATE TRIGGER trg_bus_locations_last_location
+        AFTER INSERT ON {SCHEMA_NAME}.bus_locations
+        FOR EACH ROW EXECUTE FUNCTION {SCHEMA_NAME}.update_bus_last_location()
+    """).execute_if(dialect="postgresql")
+)
+
+
 class BusRoute(Base):
     """Associates buses with routes (many-to-many relationship)."""
     __tablename__ = "bus_routes"
     __table_args__ = (
-        Index("idx_bus_current_route", "bus_id", "is_current"),
+        # Only current assignments are looked up by bus, so index just those rows.
+        Index("idx_bus_routes_bus_id_current", "bus_id", postgresql_where=text("is_current")),
         {"schema": SCHEMA_NAME}
     )
 
     bus_id = Column(
-        BigInteger,
+        Integer,
         ForeignKey(f"{SCHEMA_NAME}.buses.bus_id", ondelete="CASCADE"),
         primary_key=True
     )
     route_id = Column(
-        BigInteger,
+        Integer,
         ForeignKey(f"{SCHEMA_NAME}.routes.route_id", ondelete="CASCADE"),
         primary_key=True
     )
@@ -158,10 +226,10 @@ class BusRoute(Base):
         default=lambda: datetime.now(timezone.utc), 
         nullable=False
     )
-    is_current = Column(Boolean, default=True, nullable=False, index=True)
+    is_current = Column(Boolean, default=True, nullable=False)
 
     bus = relationship("Bus", back_populates="route_assignments")
-    route = relationship("Route", back_populates="bus_assignments")
+    route = relationship("Route", back_populates="bus_assignments", lazy="raise")
 
     def __repr__(self):
         return f"<BusRoute(bus_id={self.bus_id}, route_id={self.route_id})>"
@@ -0,0 +1,13 @@
+"""
+Prebuilt SQL statements shared by the API routers.
+
+Each statement is built once at import time, so every execution reuses
+the same compiled SQL and asyncpg prepared statement.
+"""
+
+from sqlalchemy import select, bindparam
+
+from models import Bus
+
+# Bus looked up by its public number; execute with {"bus_number": ...}
+BUS_BY_NUMBER = select(Bus).where(Bus.bus_number == bindparam("bus_number"))
@@ -0,0 +1,14 @@
+"""
+Response classes shared by the API routers.
+"""
+
+from typing import Any
+from fastapi.responses import JSONResponse
+import orjson
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson instead of the standard json module."""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
@@ -2,10 +2,9 @@
 Pydantic schemas for request/response validation.
 """
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List
 from datetime import datetime
-import re
 
 
 class LocationUpdate(BaseModel):
@@ -15,14 +14,15 @@ class LocationUpdate(BaseModel):
     longitude: float = Field(..., ge=-180, le=180, description="Longitude coordinate")
     timestamp: Optional[datetime] = Field(None, description="Location timestamp (UTC)")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "bus_id": 1,
                 "latitude": 40.7128,
                 "longitude": -74.0060
             }
         }
+    )
 
 
 class BusLocationResponse(BaseModel):
@@ -52,7 +52,7 @@ class ETAResponse(BaseModel):
     bus_number: str
     distance_km: float = Field(..., ge=0)
     speed_kmh: float = Field(..., ge=0)
-    eta_minutes: int = Field(..., ge=0)
+    eta_minutes: int
 
 
 class BusRouteInfoResponse(BaseModel):
@@ -3,7 +3,9 @@ Utility functions for the Public Transport Tracking API.
 """
 
 import math
-from typing import List, Optional
+from collections import defaultdict, deque
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from datetime import datetime
 import logging
 
@@ -12,11 +14,96 @@ from config import (
     EARTH_RADIUS_KM, 
     DEFAULT_SPEED_KMH, 
     MIN_SPEED_KMH, 
-    MAX_SPEED_KMH
+    MAX_SPEED_KMH,
+    NEAREST_STOP_HINT_WINDOW,
+    NEAREST_STOP_HINT_RADIUS_KM
 )
 
 logger = logging.getLogger(__name__)
 
+# Multiplying by a constant is cheaper than a math.radians() call per value.
+DEG_TO_RAD = math.pi / 180
+
+# The hint radius as a squared equirectangular offset in degrees (see
+# _equirectangular_sq), so the nearest-stop search never converts back to km.
+_HINT_RADIUS_SQ = (NEAREST_STOP_HINT_RADIUS_KM / (EARTH_RADIUS_KM * DEG_TO_RAD)) ** 2
+
+
+class RouteStops:
+    """
+    Stops of a route held as parallel tuples (structure of arrays).
+    
+    Distance scans walk two flat coordinate tuples instead of reading
+    attributes off one ORM object per stop, and the container can be
+    cached per route because stops rarely change. order_index maps each
+    stop_order to its position for O(1) lookups, and cumulative_km holds
+    the along-route distance from the first stop to each stop. Each stop's
+    latitude in radians and its cosine are kept too, so distance_km_to
+    only converts the bus's position.
+    """
+    
+    __slots__ = (
+        "stop_ids", "names", "orders", "lats", "lons",
+        "phis", "cos_phis", "order_index", "cumulative_km"
+    )
+    
+    def __init__(self, stops: Sequence[Stop]):
+        self.stop_ids = tuple(stop.stop_id for stop in stops)
+        self.names = tuple(stop.stop_name for stop in stops)
+        self.orders = tuple(stop.stop_order for stop in stops)
+        self.lats = tuple(stop.latitude for stop in stops)
+        self.lons = tuple(stop.longitude for stop in stops)
+        self.phis = tuple(lat * DEG_TO_RAD for lat in self.lats)
+        self.cos_phis = tuple(math.cos(phi) for phi in self.phis)
+        self.order_index = {order: index for index, order in enumerate(self.orders)}
+        self.cumulative_km = tuple(accumulate(
+            haversine_pairwise(self.lats[:-1], self.lons[:-1], self.lats[1:], self.lons[1:]),
+            initial=0.0
+        ))
+    
+    def __len__(self) -> int:
+        return len(self.lats)
+    
+    def route_distance_km(self, from_index: int, to_index: int) -> float:
+        """
+        Along-route distance in km between two stops, from the prefix sums.
+        
+        Negative when to_index is behind from_index on the route.
+        """
+        return self.cumulative_km[to_index] - self.cumulative_km[from_index]
+    
+    def distance_km_to(self, index: int, lat: float, lon: float) -> float:
+        """Great-circle distance in km from a point to the stop at index."""
+        phi = lat * DEG_TO_RAD
+        return _haversine_km(
+            phi, math.cos(phi), lon,
+            self.phis[index], self.cos_phis[index], self.lons[index]
+        )
+
+
+def _haversine_km(
+    phi1: float,
+    cos_phi1: float,
+    lon1: float,
+    phi2: float,
+    cos_phi2: float,
+    lon2: float
+) -> float:
+    """
+    Haversine distance in km from latitudes in radians, their cosines and
+    longitudes in degrees.
+    
+    The one copy of the formula: callers pass whatever they have already
+    converted or cached, so no latitude is converted or cos()'d twice.
+    """
+    sin_dphi = math.sin((phi2 - phi1) * 0.5)
+    sin_dlambda = math.sin((lon2 - lon1) * DEG_TO_RAD * 0.5)
+    
+    a = sin_dphi * sin_dphi + cos_phi1 * cos_phi2 * sin_dlambda * sin_dlambda
+    # 2·asin(√a) equals 2·atan2(√a, √(1 − a)) with one sqrt fewer; a is
+    # clamped because rounding can push it just past 1 near antipodes
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a if a < 1.0 else 1.0))
+
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
@@ -29,28 +116,122 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     Returns:
         Distance in kilometers
     """
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
+    # A parked bus reports the same fix repeatedly; skip the trigonometry
+    if lat1 == lat2 and lon1 == lon2:
+        return 0.0
     
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    phi1 = lat1 * DEG_TO_RAD
+    phi2 = lat2 * DEG_TO_RAD
     
-    return EARTH_RADIUS_KM * c
+    return _haversine_km(phi1, math.cos(phi1), lon1, phi2, math.cos(phi2), lon2)
+
+
+def haversine_distances(
+    lat: float,
+    lon: float,
+    lats: Sequence[float],
+    lons: Sequence[float]
+) -> List[float]:
+    """
+    Calculate the distances from one point to many points in a single pass.
+    
+    The trigonometry for the fixed point is evaluated once rather than
+    once per pair, which is most of the cost of a loop of
+    haversine_distance calls.
+    
+    Args:
+        lat, lon: Origin point coordinates in degrees
+        lats, lons: Destination point coordinates in degrees
+        
+    Returns:
+        Distances in kilometers, in the same order as the destinations
+    """
+    phi1 = lat * DEG_TO_RAD
+    cos_phi1 = math.cos(phi1)
+    
+    distances = []
+    for lat2, lon2 in zip(lats, lons):
+        phi2 = lat2 * DEG_TO_RAD
+        distances.append(_haversine_km(phi1, cos_phi1, lon, phi2, math.cos(phi2), lon2))
+    
+    return distances
+
+
+def _wrap_dlon(dlon: float) -> float:
+    """Wrap a longitude difference into [-180, 180] so it never spans the antimeridian the long way."""
+    if dlon > 180.0:
+        return dlon - 360.0
+    if dlon < -180.0:
+        return dlon + 360.0
+    return dlon
+
+
+def _equirectangular_sq(
+    lat: float,
+    lon: float,
+    lats: Sequence[float],
+    lons: Sequence[float]
+) -> List[float]:
+    """
+    Calculate squared equirectangular offsets, in degrees, from one point.
+    
+    Over the few kilometres between a bus and its stops this ranks points
+    the same as the haversine distance, using one cos for the origin and
+    no trigonometry per point. Only meant for comparing distances.
+    Longitude differences are wrapped, so points across the antimeridian
+    stay close.
+    """
+    cos_lat = math.cos(lat * DEG_TO_RAD)
+    
+    offsets = []
+    for lat2, lon2 in zip(lats, lons):
+        dx = _wrap_dlon(lon2 - lon) * cos_lat
+        dy = lat2 - lat
+        offsets.append(dx * dx + dy * dy)
+    
+    return offsets
+
+
+def haversine_pairwise(
+    lats1: Sequence[float],
+    lons1: Sequence[float],
+    lats2: Sequence[float],
+    lons2: Sequence[float]
+) -> List[float]:
+    """
+    Calculate the distances between matching pairs of points.
+    
+    Used for stop-to-stop segments along a route, where the caller would
+    otherwise loop over haversine_distance one pair at a time.
+    
+    Args:
+        lats1, lons1: First point of each pair in degrees
+        lats2, lons2: Second point of each pair in degrees
+        
+    Returns:
+        Distances in kilometers, one per pair
+    """
+    distances = []
+    for lat1, lon1, lat2, lon2 in zip(lats1, lons1, lats2, lons2):
+        phi1 = lat1 * DEG_TO_RAD
+        phi2 = lat2 * DEG_TO_RAD
+        distances.append(_haversine_km(phi1, math.cos(phi1), lon1, phi2, math.cos(phi2), lon2))
+    
+    return distances
 
 
 def calculate_bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate the initial bearing from point 1 to point 2."""
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dlambda = math.radians(lon2 - lon1)
+    phi1 = lat1 * DEG_TO_RAD
+    phi2 = lat2 * DEG_TO_RAD
+    dlambda = (lon2 - lon1) * DEG_TO_RAD
     
-    x = math.sin(dlambda) * math.cos(phi2)
-    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlambda)
+    # cos(phi2) appears in both terms, so each sine and cosine is taken once
+    cos_phi2 = math.cos(phi2)
+    x = math.sin(dlambda) * cos_phi2
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * cos_phi2 * math.cos(dlambda)
     
-    bearing = math.atan2(x, y)
-    bearing = math.degrees(bearing)
+    bearing = math.degrees(math.atan2(x, y))
     
     return (bearing + 360) % 360
 
@@ -64,107 +245,173 @@ def calculate_speed_kmh(
     curr_time: datetime
 ) -> float:
     """Calculate speed in km/h between two location points."""
-    time_delta_seconds = (curr_time - prev_time).total_seconds()
+    prev_phi = prev_lat * DEG_TO_RAD
+    curr_phi = curr_lat * DEG_TO_RAD
+    return _speed_kmh(
+        prev_phi, math.cos(prev_phi), prev_lon,
+        curr_phi, math.cos(curr_phi), curr_lon,
+        (curr_time - prev_time).total_seconds()
+    )
+
+
+def _speed_kmh(
+    prev_phi: float,
+    prev_cos_phi: float,
+    prev_lon: float,
+    curr_phi: float,
+    curr_cos_phi: float,
+    curr_lon: float,
+    time_delta_seconds: float
+) -> float:
+    """
+    Clamped speed in km/h over a time delta, on plain floats only.
     
+    Positions are given as for _haversine_km, so a caller walking a track
+    can reuse each point's radians and cosine for the next pair.
+    """
     if time_delta_seconds <= 0:
         return DEFAULT_SPEED_KMH
     
-    distance_km = haversine_distance(prev_lat, prev_lon, curr_lat, curr_lon)
-    speed_kmh = (distance_km / time_delta_seconds) * 3600
+    distance_km = _haversine_km(prev_phi, prev_cos_phi, prev_lon, curr_phi, curr_cos_phi, curr_lon)
+    speed_kmh = distance_km * (3600.0 / time_delta_seconds)
     
-    return max(MIN_SPEED_KMH, min(MAX_SPEED_KMH, speed_kmh))
+    # A conditional expression avoids two builtin calls per clamp
+    return (
+        MIN_SPEED_KMH if speed_kmh < MIN_SPEED_KMH
+        else MAX_SPEED_KMH if speed_kmh > MAX_SPEED_KMH
+        else speed_kmh
+    )
 
 
 def compute_rolling_average_speed(locations: List[BusLocation]) -> float:
-    """Compute the rolling average speed from a list of location points."""
+    """
+    Compute the rolling average speed from a list of location points.
+    
+    Speeds are computed in a single pass through _speed_kmh. Each point's
+    latitude in radians and its cosine are carried over to the next pair,
+    so they are evaluated once per point instead of once per pair side.
+    """
     if len(locations) < 2:
         return DEFAULT_SPEED_KMH
     
-    locations_chrono = list(reversed(locations))
-    speeds = []
-    
-    for i in range(1, len(locations_chrono)):
-        speed = calculate_speed_kmh(
-            locations_chrono[i-1].latitude,
-            locations_chrono[i-1].longitude,
-            locations_chrono[i-1].recorded_at,
-            locations_chrono[i].latitude,
-            locations_chrono[i].longitude,
-            locations_chrono[i].recorded_at
-        )
-        speeds.append(speed)
+    total_speed = 0.0
     
-    if not speeds:
-        return DEFAULT_SPEED_KMH
+    # Locations are newest first: walk the list backwards by index rather
+    # than copying it into chronological order.
+    prev = locations[-1]
+    prev_phi = prev.latitude * DEG_TO_RAD
+    prev_cos_phi = math.cos(prev_phi)
+    prev_lon = prev.longitude
+    prev_time = prev.recorded_at
+    
+    for i in range(len(locations) - 2, -1, -1):
+        curr = locations[i]
+        phi = curr.latitude * DEG_TO_RAD
+        cos_phi = math.cos(phi)
+        lon = curr.longitude
+        # Subtracting aware datetimes is cheaper than datetime.timestamp()
+        # on each fix, so POSIX seconds are not precomputed here.
+        time_delta_seconds = (curr.recorded_at - prev_time).total_seconds()
+        
+        total_speed += _speed_kmh(
+            prev_phi, prev_cos_phi, prev_lon,
+            phi, cos_phi, lon,
+            time_delta_seconds
+        )
+        
+        prev_phi, prev_cos_phi, prev_lon, prev_time = phi, cos_phi, lon, curr.recorded_at
     
-    return sum(speeds) / len(speeds)
+    return total_speed / (len(locations) - 1)
 
 
 def find_next_stop_index(
-    stops: List[Stop], 
+    stops: Union[RouteStops, List[Stop]], 
     current_lat: float, 
-    current_lon: float
+    current_lon: float,
+    hint: Optional[int] = None
 ) -> int:
-    """Find the index of the next stop based on current position."""
+    """
+    Find the index of the next stop based on current position.
+    
+    When a hint (the bus's previous stop index) is given, only the few
+    stops starting at the hint are checked; the full route is scanned
+    only if none of them is within NEAREST_STOP_HINT_RADIUS_KM.
+    """
     if not stops:
         return 0
     
-    min_distance = float('inf')
-    closest_index = 0
+    if not isinstance(stops, RouteStops):
+        stops = RouteStops(stops)
     
-    for i, stop in enumerate(stops):
-        distance = haversine_distance(
-            current_lat, 
-            current_lon, 
-            stop.latitude, 
-            stop.longitude
+    if hint is not None and 0 <= hint < len(stops):
+        window_end = min(hint + NEAREST_STOP_HINT_WINDOW, len(stops))
+        window = _equirectangular_sq(
+            current_lat,
+            current_lon,
+            stops.lats[hint:window_end],
+            stops.lons[hint:window_end]
         )
-        if distance < min_distance:
-            min_distance = distance
-            closest_index = i
+        best = min(range(len(window)), key=window.__getitem__)
+        if window[best] <= _HINT_RADIUS_SQ:
+            return hint + best
     
-    return closest_index
+    offsets = _equirectangular_sq(current_lat, current_lon, stops.lats, stops.lons)
+    
+    return min(range(len(offsets)), key=offsets.__getitem__)
 
 
-def find_stop_by_order(stops: List[Stop], stop_order: int) -> Optional[Stop]:
-    """Find a stop by its stop_order value."""
-    for stop in stops:
+def find_stop_index_by_order(
+    stops: Union[RouteStops, List[Stop]],
+    stop_order: int
+) -> Optional[int]:
+    """
+    Find the position of a stop by its stop_order value.
+    
+    RouteStops answers from its order_index with a single dict lookup;
+    a plain Stop list is scanned, since building a map for one lookup
+    would cost the same scan.
+    """
+    if isinstance(stops, RouteStops):
+        return stops.order_index.get(stop_order)
+    
+    for index, stop in enumerate(stops):
         if stop.stop_order == stop_order:
-            return stop
+            return index
     return None
 
 
 def calculate_route_distance_to_stop(
-    stops: List[Stop],
+    stops: Union[RouteStops, List[Stop]],
     target_stop_index: int,
     current_lat: float,
-    current_lon: float
+    current_lon: float,
+    current_stop_index: Optional[int] = None
 ) -> float:
-    """Calculate the total route distance to a target stop."""
+    """
+    Calculate the total route distance to a target stop.
+    
+    Callers that already located the bus (e.g. with find_next_stop_index)
+    can pass current_stop_index to skip searching the route again.
+    """
     if target_stop_index >= len(stops) or not stops:
         return 0.0
     
-    current_stop_index = find_next_stop_index(stops, current_lat, current_lon)
+    if not isinstance(stops, RouteStops):
+        stops = RouteStops(stops)
     
-    if current_stop_index >= target_stop_index:
-        return haversine_distance(
-            current_lat, current_lon,
-            stops[target_stop_index].latitude,
-            stops[target_stop_index].longitude
-        )
+    if current_stop_index is None:
+        current_stop_index = find_next_stop_index(stops, current_lat, current_lon)
     
-    total_distance = 0.0
-    prev_lat, prev_lon = current_lat, current_lon
+    if current_stop_index >= target_stop_index:
+        return stops.distance_km_to(target_stop_index, current_lat, current_lon)
     
-    for i in range(current_stop_index, target_stop_index + 1):
-        distance = haversine_distance(
-            prev_lat, prev_lon,
-            stops[i].latitude, stops[i].longitude
-        )
-        total_distance += distance
-        prev_lat, prev_lon = stops[i].latitude, stops[i].longitude
+    distance_to_current_stop = stops.distance_km_to(current_stop_index, current_lat, current_lon)
     
-    return total_distance
+    return distance_to_current_stop + stops.route_distance_km(current_stop_index, target_stop_index)
+
+
+# Labels for 0.0 km to 10.0 km in 100 m steps, built once at import time.
+_KM_TENTHS_LABELS = tuple(f"{tenths / 10:.1f} km" for tenths in range(101))
 
 
 def format_distance(distance_km: float) -> str:
@@ -172,7 +419,13 @@ def format_distance(distance_km: float) -> str:
     if distance_km < 1:
         return f"{int(distance_km * 1000)} m"
     elif distance_km < 10:
-        return f"{distance_km:.1f} km"
+        scaled = distance_km * 10
+        tenths = round(scaled)
+        # On an exact half the product may have rounded (1.15 * 10 == 11.5),
+        # so let :.1f round from the stored value as it always has.
+        if scaled - tenths in (0.5, -0.5):
+            return f"{distance_km:.1f} km"
+        return _KM_TENTHS_LABELS[tenths]
     else:
         return f"{int(distance_km)} km"
 
@@ -188,6 +441,61 @@ def estimate_arrival_time(distance_km: float, speed_kmh: float) -> int:
     return max(1, eta_minutes)
 
 
+def estimate_arrival_times(distances_km: Sequence[float], speed_kmh: float) -> List[int]:
+    """
+    Estimate arrival times in minutes for many distances at one speed.
+    
+    Matches estimate_arrival_time per distance without a function call
+    per distance. The division keeps the scalar's operation order so both
+    round to the same minute.
+    """
+    if speed_kmh <= 0:
+        return [60] * len(distances_km)
+    
+    etas = []
+    for distance_km in distances_km:
+        eta_minutes = int(distance_km / speed_kmh * 60)
+        etas.append(eta_minutes if eta_minutes > 1 else 1)
+    
+    return etas
+
+
+def estimate_fleet_etas(
+    stops: RouteStops,
+    positions: Sequence[Tuple[float, float]],
+    speeds_kmh: Sequence[float]
+) -> List[List[int]]:
+    """
+    Estimate arrival times in minutes from every bus to every stop of a route.
+    
+    Each bus is located on the route once, and its distances to all stops
+    come from the route's prefix sums, as in calculate_route_distance_to_stop.
+    
+    Args:
+        stops: Cached stop arrays of the route
+        positions: (latitude, longitude) of each bus on the route
+        speeds_kmh: Average speed of each bus
+        
+    Returns:
+        One row per bus with the ETA to each stop, in stop order
+    """
+    etas = []
+    for (lat, lon), speed_kmh in zip(positions, speeds_kmh):
+        current_stop_index = find_next_stop_index(stops, lat, lon)
+        distance_to_current_stop = stops.distance_km_to(current_stop_index, lat, lon)
+        
+        distances_km = [
+            stops.distance_km_to(index, lat, lon) for index in range(current_stop_index)
+        ]
+        distances_km.extend(
+            distance_to_current_stop + stops.route_distance_km(current_stop_index, index)
+            for index in range(current_stop_index, len(stops))
+        )
+        etas.append(estimate_arrival_times(distances_km, speed_kmh))
+    
+    return etas
+
+
 def is_bus_approaching(
     prev_lat: float,
     prev_lon: float,
@@ -197,7 +505,75 @@ def is_bus_approaching(
     stop_lon: float
 ) -> bool:
     """Determine if a bus is approaching a stop."""
-    prev_distance = haversine_distance(prev_lat, prev_lon, stop_lat, stop_lon)
-    curr_distance = haversine_distance(curr_lat, curr_lon, stop_lat, stop_lon)
+    prev_offset, curr_offset = _equirectangular_sq(
+        stop_lat,
+        stop_lon,
+        (prev_lat, curr_lat),
+        (prev_lon, curr_lon)
+    )
+    
+    return curr_offset < prev_offset
+
+
+def is_bus_approaching_stops(
+    prev_lat: float,
+    prev_lon: float,
+    curr_lat: float,
+    curr_lon: float,
+    stops: RouteStops
+) -> List[bool]:
+    """
+    Determine, for every stop of a route at once, whether a bus is approaching it.
+    
+    Equivalent to is_bus_approaching per stop: offsets are scaled by each
+    stop's own cached latitude cosine, so no trigonometry runs per call.
+    """
+    approaching = []
+    for stop_lat, stop_lon, cos_lat in zip(stops.lats, stops.lons, stops.cos_phis):
+        prev_dx = _wrap_dlon(prev_lon - stop_lon) * cos_lat
+        prev_dy = prev_lat - stop_lat
+        curr_dx = _wrap_dlon(curr_lon - stop_lon) * cos_lat
+        curr_dy = curr_lat - stop_lat
+        approaching.append(
+            curr_dx * curr_dx + curr_dy * curr_dy
+            < prev_dx * prev_dx + prev_dy * prev_dy
+        )
+    
+    return approaching
+
+
+def build_route_transfer_counts(
+    stop_names_by_route: Dict[int, Iterable[str]]
+) -> Dict[Tuple[int, int], int]:
+    """
+    Count the fewest route changes between every pair of connected routes.
+    
+    Two routes are adjacent when they serve a stop with the same name.
+    Pairs with no path between them are left out.
+    """
+    routes_by_stop = defaultdict(set)
+    for route_id, stop_names in stop_names_by_route.items():
+        for stop_name in stop_names:
+            routes_by_stop[stop_name].add(route_id)
+    
+    neighbours = {route_id: set() for route_id in stop_names_by_route}
+    for route_ids in routes_by_stop.values():
+        for route_id in route_ids:
+            neighbours[route_id] |= route_ids
+    
+    transfer_counts = {}
+    for start_route_id in neighbours:
+        depths = {start_route_id: 0}
+        queue = deque([start_route_id])
+        while queue:
+            route_id = queue.popleft()
+            for neighbour_id in neighbours[route_id]:
+                if neighbour_id not in depths:
+                    depths[neighbour_id] = depths[route_id] + 1
+                    queue.append(neighbour_id)
+        
+        for end_route_id, transfers in depths.items():
+            if end_route_id != start_route_id:
+                transfer_counts[(start_route_id, end_route_id)] = transfers
     
-    return curr_distance < prev_distance
+    return transfer_counts